@@ -0,0 +1,322 @@
+'''Benchmarks for the simulators' hot paths, run with `python bench.py`.
+
+`python bench.py --json results.json` runs the seeded suite of cases below
+and stores seconds, throughput and peak traced memory per case and size;
+`--compare old.json` prints the change against a previous run. `--tables`
+prints the engine comparison tables instead, `--gui` the headless frame
+times of the GUI.'''
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tracemalloc
+from time import perf_counter
+import numpy as np
+from nsp2p import Network, Node, ring_graph
+from dht import DHT, ArrayRing
+from routing import RoutingIndex
+import runtime
+
+def best_time(function, *args, repeat = 3):
+    '''Best wall time of `repeat` calls, in seconds'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        best = min(best, perf_counter() - start)
+    return best
+
+def bench_init_graph(sizes = (10**3, 10**4, 10**5, 10**6), l = 8):
+    '''Construction time should grow linearly with v: ns/peer stays flat'''
+    print('init_graph (l={})'.format(l))
+    print('{:>9} {:>12} {:>12} {:>12}'.format('v', 'ring_graph', 'csr', 'dict'))
+    for v in sizes:
+        np.random.seed(0)
+        times = [best_time(ring_graph, v, l), best_time(Network, v, l, 'csr')]
+        times.append(best_time(Network, v, l) if v <= 10**5 else None)
+        print('{:>9} '.format(v) + ' '.join(
+            '{:>9.1f}ns'.format(t / v * 1e9) if t is not None else '{:>12}'.format('-') for t in times))
+
+
+class ListNode:
+    '''The list based Node the simulator used before, kept as a reference'''
+    def __init__(self, links):
+        self.links = list(links)
+        self.quality = [0] * len(links)
+        self.candidates = []
+
+    def sort(self, reverse = True):
+        links, quality = zip(*sorted(zip(self.links, self.quality), key=lambda x: x[1], reverse=reverse))
+        self.links, self.quality = list(links), list(quality)
+
+    def increment_quality(self, link, amount = 1):
+        self.quality[self.links.index(link)] += amount
+
+    def update(self, l, n = 3):
+        self.candidates = sorted(self.candidates, reverse=True, key=lambda x: x[1])[:n]
+        for i in range(len(self.candidates)):
+            worst = min(self.quality)
+            if worst < self.candidates[i][1]:
+                j = self.quality.index(worst)
+                self.links[j] = self.candidates[i][0]
+                self.quality[j] = self.candidates[i][1]
+            else:
+                break
+        self.sort()
+        self.links = self.links[:l]
+        self.candidates = []
+        self.quality = [0] * len(self.quality)
+
+def bench_node(degrees = (8, 32, 128, 512), calls = 20000):
+    '''increment_quality and update of Node against the list based class'''
+    print('Node (ns/call)')
+    print('{:>6} {:>14} {:>14} {:>14} {:>14}'.format('l', 'incr list', 'incr Node', 'update list', 'update Node'))
+    for l in degrees:
+        rng = np.random.default_rng(0)
+        links = rng.permutation(10 * l).tolist()[:l]
+        hits = rng.choice(links, calls).tolist()
+        offers = [(int(x), int(q)) for x, q in zip(rng.integers(0, 10 * l, 3 * l), rng.integers(0, 50, 3 * l))]
+        times = []
+
+        for cls in (ListNode, Node):
+            node = cls(links)
+            times.append(best_time(lambda: [node.increment_quality(link) for link in hits]) / calls)
+
+        for cls in (ListNode, Node):
+            def updates():
+                for _ in range(calls // 10):
+                    node = cls(links)
+                    node.quality = list(range(l))
+                    node.candidates = offers.copy()
+                    node.update(l)
+            times.append(best_time(updates) / (calls // 10))
+
+        print('{:>6} '.format(l) + ' '.join('{:>12.0f}ns'.format(t * 1e9) for t in times))
+
+def bench_dht_build(sizes = (10**2, 10**3, 10**4, 10**5), k = 32):
+    '''DHT.from_ids against inserting the same ids one by one; `differ` counts
+    the nodes whose finger table or pred the incremental path got wrong'''
+    print('DHT build (k={})'.format(k))
+    print('{:>9} {:>12} {:>12} {:>8}'.format('n', 'insert', 'from_ids', 'differ'))
+    for n in sizes:
+        ids = np.random.default_rng(0).choice(2**k, n, replace=False).tolist()
+        bulk = DHT.from_ids(ids, k)
+        times = [None, best_time(DHT.from_ids, ids, k)]
+        differ = '-'
+        if n <= 10**4:
+            def inserts():
+                dht = DHT(k)
+                for id in ids:
+                    dht.insert(id)
+                return dht
+            times[0] = best_time(inserts, repeat=1)
+            one_by_one = inserts()
+            differ = sum((a.FT, a.pred) != (b.FT, b.pred) for a, b in
+                         zip(one_by_one.ring.elements.values(), bulk.ring.elements.values()))
+        print('{:>9} '.format(n) + ' '.join(
+            '{:>9.1f}us'.format(t / n * 1e6) if t is not None else '{:>12}'.format('-') for t in times)
+            + ' {:>8}'.format(differ))
+
+def bench_dht_search(sizes = (10**3, 10**5), keys = 10**6, k = 32):
+    '''ArrayRing.search against circular_search_on_ring, per key, with the mean hops'''
+    print('DHT search ({} keys, k={})'.format(keys, k))
+    print('{:>9} {:>12} {:>12} {:>8}'.format('n', 'Ring', 'ArrayRing', 'hops'))
+    for n in sizes:
+        rng = np.random.default_rng(0)
+        dht = DHT.from_ids(rng.choice(2**k, n, replace=False).tolist(), k)
+        ring = ArrayRing.from_ring(dht.ring)
+        targets = rng.integers(0, 2**k, keys)
+        sample = targets[:keys // 100].tolist()
+        times = [best_time(lambda: [dht.search(t) for t in sample], repeat=1) / len(sample),
+                 best_time(ring.search, targets) / keys]
+        hops = ring.search(targets)[1].mean()
+        print('{:>9} '.format(n) + ' '.join('{:>10.0f}ns'.format(t * 1e9) for t in times)
+              + ' {:>8.2f}'.format(hops))
+
+def bench_gui(sizes = (256, 2048, 8192), frames = 200):
+    '''Headless (dummy SDL driver) NetGui: redrawing every edge after an evolve
+    against updating the edge layer with the edges that changed, and the time
+    of a frame'''
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    from gui import NetGui
+    print('NetGui (headless)')
+    print('{:>9} {:>10} {:>12} {:>12} {:>12} {:>12}'.format('v', 'changed', 'full redraw', 'incremental', '1% edges', 'frame'))
+    for v in sizes:
+        np.random.seed(0)
+        gui = NetGui(v, 8)
+        # the first evolve rewires most of the ring, time the second one
+        for _ in range(2):
+            gui.edge_layer.update(*gui.simulation.take_changes())
+            gui.simulation.net.simulate(4 * v, batch_size=1000)
+            gui.simulation.evolve()
+        full = best_time(lambda: gui._draw_edges(gui.bg.copy(), gui.net.edges), repeat=1)
+        start = perf_counter()
+        added, removed = gui.simulation.take_changes()
+        gui.edge_layer.update(added, removed)
+        incremental = perf_counter() - start
+        # erasing and drawing back 1% of the edges
+        some = sorted(gui.net.edges)[::100]
+        few = best_time(lambda: (gui.edge_layer.update(removed=some), gui.edge_layer.update(added=some)), repeat=1) / 2
+        frame = best_time(lambda: [gui._draw() for _ in range(frames)], repeat=1) / frames
+        print('{:>9} {:>10} {:>10.1f}ms {:>10.1f}ms {:>10.1f}ms {:>10.2f}ms'.format(
+            v, len(added) + len(removed), full * 1e3, incremental * 1e3, few * 1e3, frame * 1e3))
+
+
+def network(v, l = 8, engine = 'dict', iterations = 0, evolved = False):
+    '''Seeded network, optionally warmed up by `iterations` searches and an evolve'''
+    np.random.seed(0)
+    net = Network(v, l, engine)
+    net.simulate(iterations, batch_size=1000 if iterations else None)
+    if evolved:
+        net.evolve()
+    return net
+
+def replace_peers(net, nodes):
+    for node in nodes:
+        net.leave(node)
+        net.join()
+
+def routed(net):
+    net.routes = RoutingIndex()
+    return net
+
+def dht_ids(n, k = 32):
+    return np.random.default_rng(0).choice(2**k, n, replace=False).tolist()
+
+def dht_keys(n, k = 32):
+    return np.random.default_rng(1).integers(0, 2**k, n).tolist()
+
+def inserts(dht, ids, linear = False):
+    for id in ids:
+        dht.linear_insert(id) if linear else dht.insert(id)
+
+# name: (quick sizes, full sizes, setup(size) -> args, run(*args), operations(size))
+# every setup is seeded, and only run is timed
+CASES = {
+    'init_graph': ((1000, 10000), (1000, 10000, 100000),
+                   lambda v: (v,), lambda v: Network(v, 8), lambda v: v),
+    'init_graph_csr': ((1000, 10000), (1000, 10000, 100000, 1000000),
+                       lambda v: (v,), lambda v: Network(v, 8, 'csr'), lambda v: v),
+    'bfs': ((256, 2048), (256, 2048, 16384),
+            lambda v: (network(v), np.random.RandomState(1).randint(0, v, (200, 2)).tolist()),
+            lambda net, pairs: [net.bfs(a, b) for a, b in pairs], lambda v: 200),
+    'simulate_routes': ((256, 2048), (256, 2048, 16384),
+                        lambda v: (routed(network(v)),), lambda net: net.simulate(2000), lambda v: 2000),
+    'simulate_batch': ((256, 2048), (256, 2048, 16384, 131072),
+                       lambda v: (network(v),), lambda net: net.simulate(2000, batch_size=1000), lambda v: 2000),
+    'churn_events': ((2048, 16384), (2048, 16384, 131072),
+                     lambda v: (network(v), np.random.RandomState(1).choice(v, 1000, replace=False).tolist()),
+                     replace_peers, lambda v: 2000),
+    'churn_events_csr': ((2048, 16384), (2048, 16384, 131072),
+                         lambda v: (network(v, engine='csr'), np.random.RandomState(1).choice(v, 1000, replace=False).tolist()),
+                         replace_peers, lambda v: 2000),
+    'evolve': ((256, 2048), (256, 2048, 16384),
+               lambda v: (network(v, iterations=4 * v),), lambda net: net.evolve(), lambda v: v),
+    'evolve_csr': ((256, 2048), (256, 2048, 16384, 131072),
+                   lambda v: (network(v, engine='csr', iterations=4 * v),), lambda net: net.evolve(), lambda v: v),
+    'integrity_check': ((256, 2048), (256, 2048, 16384),
+                        lambda v: (network(v, iterations=4 * v, evolved=True),), lambda net: net.integrity_check(), lambda v: v),
+    'dht_insert': ((100, 1000), (100, 1000, 10000),
+                   lambda n: (DHT(32), dht_ids(n)), inserts, lambda n: n),
+    'dht_linear_insert': ((100, 1000), (100, 1000, 4000),
+                          lambda n: (DHT(32), dht_ids(n), True), inserts, lambda n: n),
+    'dht_from_ids': ((1000, 10000), (1000, 10000, 100000),
+                     lambda n: (dht_ids(n), 32), DHT.from_ids, lambda n: n),
+    'dht_search': ((1000, 10000), (1000, 10000, 100000),
+                   lambda n: (DHT.from_ids(dht_ids(n), 32), dht_keys(10000)),
+                   lambda dht, keys: [dht.search(key) for key in keys], lambda n: 10000),
+    'dht_linear_search': ((100, 1000), (100, 1000, 10000),
+                          lambda n: (DHT.from_ids(dht_ids(n), 32), dht_keys(1000)),
+                          lambda dht, keys: [dht.linear_search(key) for key in keys], lambda n: 1000),
+    'array_ring_search': ((1000, 100000), (1000, 100000, 1000000),
+                          lambda n: (ArrayRing.from_ids(dht_ids(n), 32), np.array(dht_keys(10**6))),
+                          lambda ring, keys: ring.search(keys), lambda n: 10**6),
+    'runtime_flood': ((256, 2048), (256, 2048, 10000),
+                      lambda v: (network(v),), lambda net: runtime.run(net, 1000, max_depth=3), lambda v: 1000),
+}
+
+def measure(setup, run, size, repeat = 3):
+    '''Best time of `repeat` runs, each on a fresh setup, and the peak memory
+    traced during one more run'''
+    best = float('inf')
+    for _ in range(repeat):
+        random.seed(0)
+        args = setup(size)
+        start = perf_counter()
+        run(*args)
+        best = min(best, perf_counter() - start)
+
+    random.seed(0)
+    args = setup(size)
+    tracemalloc.start()
+    try:
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def suite(names = None, full = False, repeat = 3):
+    '''Runs the CASES (all, or the given names) and returns the results as a
+    json-able dict'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    results = {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+               'full': full, 'cases': {}}
+
+    print('{:<20} {:>9} {:>12} {:>14} {:>12}'.format('case', 'size', 'seconds', 'ops/s', 'peak MiB'))
+    for name in names or CASES:
+        quick, sizes, setup, run, operations = CASES[name]
+        results['cases'][name] = {}
+        for size in sizes if full else quick:
+            seconds, peak = measure(setup, run, size, repeat)
+            ops = operations(size) / seconds
+            results['cases'][name][str(size)] = {'seconds': seconds, 'ops_per_s': ops, 'peak_bytes': peak}
+            print('{:<20} {:>9} {:>12.4f} {:>14.0f} {:>12.2f}'.format(name, size, seconds, ops, peak / 2**20))
+    return results
+
+def compare(old, new, threshold = 1.1):
+    '''Prints new/old time ratios of the cases both results have, marking
+    the slowdowns beyond threshold'''
+    print('{:<20} {:>9} {:>10} {:>10}'.format('case', 'size', 'time', 'memory'))
+    for name, sizes in new['cases'].items():
+        for size, result in sizes.items():
+            before = old['cases'].get(name, {}).get(size)
+            if before is None:
+                continue
+            time = result['seconds'] / before['seconds']
+            memory = result['peak_bytes'] / before['peak_bytes'] if before['peak_bytes'] else 1.0
+            print('{:<20} {:>9} {:>9.2f}x {:>9.2f}x{}'.format(
+                name, size, time, memory, '  slower' if time > threshold else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', help='cases to run, all by default: ' + ', '.join(CASES))
+    parser.add_argument('--full', action='store_true', help='run the larger sizes too')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='file to store the results in')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    parser.add_argument('--tables', action='store_true', help='print the engine comparison tables')
+    parser.add_argument('--gui', action='store_true', help='print the headless GUI frame times')
+    args = parser.parse_args()
+
+    if args.gui:
+        bench_gui()
+    elif args.tables:
+        bench_init_graph()
+        bench_node()
+        bench_dht_build()
+        bench_dht_search()
+    else:
+        results = suite(args.cases, args.full, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=1)
+        if args.compare:
+            with open(args.compare) as file:
+                compare(json.load(file), results)
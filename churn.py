@@ -0,0 +1,114 @@
+'''Churn for nsp2p.Network: peers join as a Poisson process and leave when
+their session ends, between the simulate and evolve epochs of a run'''
+import heapq
+from time import perf_counter
+import numpy as np
+from nsp2p import Network
+
+class Churn:
+    '''Seeded membership events: `rate` arrivals per time unit, every peer
+    staying for a session drawn from `session`, 'exponential' or 'pareto'
+    (heavy tailed, with `shape` > 1) of mean `mean_session`, or a function
+    of the numpy Generator returning one length. The network settles
+    around rate * mean_session peers.'''
+
+    def __init__(self, rate, mean_session, session = 'exponential', shape = 2.0, seed = None) -> None:
+        if session not in ('exponential', 'pareto') and not callable(session):
+            raise ValueError('unknown session distribution: {}'.format(session))
+        if session == 'pareto' and shape <= 1:
+            raise ValueError('a pareto session needs shape > 1 to have a mean')
+        self.rate = rate
+        self.mean_session = mean_session
+        self.session = session
+        self.shape = shape
+        self.rng = np.random.default_rng(seed)
+        self.time = 0.0
+        self.next_arrival = self.rng.exponential(1 / rate)
+        self.departures = []        # heap of (time, peer)
+        self.ends = {}              # peer -> end of its session
+
+    def session_length(self):
+        if callable(self.session):
+            return self.session(self.rng)
+        if self.session == 'exponential':
+            return self.rng.exponential(self.mean_session)
+        # Lomax: pareto with the minimum shifted to 0, mean scale / (shape - 1)
+        return self.mean_session * (self.shape - 1) * self.rng.pareto(self.shape)
+
+    def attach(self, net):
+        '''Starts a session for every peer already in net, as if the churn had
+        always been going on: what is left of a session in progress is
+        drawn from the residual distribution (a pareto of shape - 1 for
+        pareto sessions; a callable session is drawn anew)'''
+        for node in net.elements:
+            if self.session == 'pareto':
+                self._start(node, self.mean_session * (self.shape - 1) * self.rng.pareto(self.shape - 1))
+            else:
+                self._start(node)
+
+    def _start(self, node, length = None):
+        end = self.time + (self.session_length() if length is None else length)
+        self.ends[node] = end
+        heapq.heappush(self.departures, (end, node))
+
+    def advance(self, net, until):
+        '''Applies to net the joins and leaves up to time `until`, in order.
+        Returns (joins, leaves).'''
+        joins = leaves = 0
+        while True:
+            leaving = self.departures[0][0] if self.departures else float('inf')
+            if min(self.next_arrival, leaving) > until:
+                break
+
+            if self.next_arrival <= leaving:
+                self.time = self.next_arrival
+                self._start(net.join())
+                self.next_arrival += self.rng.exponential(1 / self.rate)
+                joins += 1
+            else:
+                self.time, node = heapq.heappop(self.departures)
+                # a peer that left some other way, its id maybe taken again
+                if self.ends.get(node) != self.time:
+                    continue
+                del self.ends[node]
+                net.leave(node)
+                leaves += 1
+
+        self.time = until
+        return joins, leaves
+
+def run(net, churn, epochs = 10, epoch_length = 1.0, iterations = 1000, max_depth = 4, batch_size = 1000, evolve = True):
+    '''Each epoch applies the churn of `epoch_length` time units, runs
+    `iterations` random searches, then evolves and repairs the network.
+    Returns one record per epoch, with the lookups made after the churn.'''
+    if not churn.ends:
+        churn.attach(net)
+    records = []
+
+    for epoch in range(epochs):
+        began = perf_counter()
+        joins, leaves = churn.advance(net, churn.time + epoch_length)
+        seconds = perf_counter() - began
+
+        tests = net.tests
+        net.simulate(iterations, max_depth, batch_size=batch_size)
+        record = {'epoch': epoch, 'time': churn.time, 'peers': len(net.elements), 'joins': joins, 'leaves': leaves,
+                  'events_per_s': (joins + leaves) / seconds if seconds else 0.0,
+                  'success_rate': (net.tests - tests) / iterations if iterations else 0.0,
+                  'avg_distance': net.avg_distance}
+        if evolve:
+            net.evolve()
+            record['repairs'] = len(net.integrity_check())
+        records.append(record)
+
+    return records
+
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    net = Network(10**4, 8)
+    # 1% of the peers replaced per time unit on average
+    churn = Churn(rate=100, mean_session=100, session='pareto', seed=0)
+    for record in run(net, churn, epochs=10):
+        print('epoch {epoch} peers={peers} joins={joins} leaves={leaves} events/s={events_per_s:.0f} '
+              'success={success_rate:.3f} avg_distance={avg_distance:.3f} repairs={repairs}'.format(**record))
@@ -1,4 +1,73 @@
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, deque
+import hashlib
+import numbers
+import numpy as np
+from snapshot import load_arrays, save_arrays
 
+def finger_rows(ids, k):
+    '''Finger tables of the sorted ring `ids` as a (n, k) array of positions in
+    ids: row i column j is the successor of ids[i] + 2^j, found for all rows
+    by one searchsorted per column'''
+    ids = np.asarray(ids, dtype=np.int64 if k <= 62 else object)
+    rows = np.empty((k, ids.size), dtype=np.int64)
+    for j in range(k):
+        rows[j] = np.searchsorted(ids, (ids + 2**j) % 2**k)
+    return (rows % ids.size).T
+
+def fingers(ids, k):
+    '''Finger tables of the sorted ring `ids` as a (n, k) array of ids'''
+    ids = np.asarray(ids, dtype=np.int64 if k <= 62 else object)
+    return ids[finger_rows(ids, k)]
+
+def objects(items):
+    '''1-d object array of items, tuples included'''
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+    return array
+
+def bit_length(values):
+    '''int.bit_length of every int64 in `values`: frexp's exponent, less one
+    where the float rounding carried into the next power of two'''
+    exponent = np.frexp(values.astype(np.float64))[1].astype(np.int64)
+    exponent -= (exponent > 0) & ((np.int64(1) << np.maximum(exponent - 1, 0)) > values)
+    return exponent
+
+def key_position(key, k):
+    '''Ring position of a key: integers, numpy ones included, are taken
+    mod 2^k, anything else is hashed'''
+    if isinstance(key, numbers.Integral):
+        return int(key) % 2**k
+    digest = hashlib.sha1(str(key).encode()).digest()
+    return int.from_bytes(digest, 'big') % 2**k
+
+def virtual_ids(peers, vnodes, k):
+    '''Ring positions of `vnodes` virtual nodes for each of `peers` peers, as
+    sorted unique ids and the peer owning each: position j of peer p is a
+    splitmix64 hash of p * vnodes + j, cut to k bits. On a collision the
+    lower peer keeps the position.'''
+    x = np.arange(peers * vnodes, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = (x ^ (x >> np.uint64(31))) >> np.uint64(64 - k)
+    order = np.argsort(x, kind='stable')
+    ids = x[order].astype(np.int64)
+    first = np.ones(ids.size, dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    return ids[first], order[first] // vnodes
+
+def load_report(owners, pred_distance, items, k, peers = None):
+    '''Key-space share and stored items of every peer, summed over its nodes
+    with bincount; the ratios are max / mean, 1 for a perfect split'''
+    peers = int(owners.max()) + 1 if peers is None else peers
+    # pred_distance is 0 only on a one node ring, which owns everything
+    space = np.where(pred_distance == 0, 2**k, pred_distance).astype(np.float64)
+    share = np.bincount(owners, weights=space, minlength=peers) / 2**k
+    items = np.bincount(owners, weights=items, minlength=peers).astype(np.int64)
+    return {'share': share, 'items': items,
+            'share_ratio': share.max() * peers,
+            'items_ratio': items.max() * peers / items.sum() if items.sum() else 1.0}
 
 
 class Node:
@@ -8,7 +77,7 @@ class Node:
         self.pred_distance = pred_distance
         self.FT = [succ] * k
         self.cicle = 2**k
-        self.resources = []
+        self.resources = {}
     
     def __repr__(self) -> str:
         return 'Node' + str(self.resources)
@@ -34,6 +103,7 @@ class Ring:
         self.start_id = None
         self.k = k
         self.elements = {}
+        self.cache = None
         self.__2_pow = [2**i for i in range(k+1)]
     
     def __repr__(self) -> str:
@@ -68,6 +138,40 @@ class Ring:
             node = self.elements[node].FT[i]
         return node
 
+    def linear_search_path(self, t_ids, id):
+        '''linear_search_on_ring, also returning the nodes visited and the FT row
+        of every hop (always 0, the succ)'''
+        path, rows = [id], []
+        if self.elements[id].pred_distance == 0:
+            return id, path, rows
+
+        while self.is_not_in_node(t_ids, id):
+            id = self.elements[id].succ
+            path.append(id)
+            rows.append(0)
+        return id, path, rows
+
+    def circular_search_path(self, t_ids, start):
+        '''circular_search_on_ring, also returning the nodes visited and the FT
+        row of every hop'''
+        node = start
+        path, rows = [node], []
+
+        if self.elements[node].pred_distance == 0:
+            return node, path, rows
+
+        i = self.k
+
+        while self.is_not_in_node(t_ids, node):
+            i = self._int_log2(self.distance(node, t_ids), i-1)
+            rows.append(i)
+            if i==0:
+                path.append(self.elements[node].succ)
+                return path[-1], path, rows
+            node = self.elements[node].FT[i]
+            path.append(node)
+        return node, path, rows
+
     def linear_insert_on_ring(self, id):
         if self.start_id == None:
             self.elements[id] = Node(self.k, id, id, 0)
@@ -77,11 +181,18 @@ class Ring:
             self._insert_id_before_node(id, succ)
 
     def _insert_id_before_node(self, id, succ):
+        '''Links id between succ and its pred, and takes over from succ the
+        resources whose keys now fall in (pred, id]'''
         pred = self.elements[succ].pred
-        self.elements[id] = Node(self.k, pred, succ, self.distance(pred, id))
+        node = self.elements[id] = Node(self.k, pred, succ, self.distance(pred, id))
+        resources = self.elements[succ].resources
+        for key in [key for key in resources if self.distance(key_position(key, self.k), id) < node.pred_distance]:
+            node.resources[key] = resources.pop(key)
         self.elements[succ].pred = id
         self.elements[succ].pred_distance = self.distance(id, succ)
         self.elements[pred].succ = id
+        if self.cache is not None:
+            self.cache.invalidate(succ)
 
         self.start_id = id
     
@@ -114,30 +225,63 @@ class Ring:
             self.elements[pred].FT[i] = id
         
     def _iteratively_fix_FTs(self, id, pred, start):
-        '''Updates some nodes' FT after a node creation'''
-
-        log_distance = self.k - 1
-
-        while True:
-            log_distance = self._int_log2(self.distance(start, id), log_distance)
-            if log_distance == 0:
-                return
-            
+        '''Updates some nodes' FT after a node creation: row i of the nodes in
+        (pred - 2^i, id - 2^i], whose successor of node + 2^i is now id'''
+        for i in range(self.k - 1, 0, -1):
             # the range of nodes to fix is (low, high]
-            low = self.distance(0, pred - self.__2_pow[log_distance] + 1)
-            high = self.distance(0, id - self.__2_pow[log_distance])
-            start = self.circular_search_on_ring(low, start)
-            node = start
-            
+            low = self.distance(0, pred - self.__2_pow[i] + 1)
+            high = self.distance(0, id - self.__2_pow[i])
             distance = self.distance(low, high)
+            first = node = self.circular_search_on_ring(low, start)
 
+            # the range can hold the whole ring when it is this sparse
             while self.distance(low, node) <= distance:
-                self.elements[node].FT[log_distance] = id
+                self.elements[node].FT[i] = id
                 node = self.elements[node].succ
-            
-            log_distance -= 1
-            start = self.elements[self.elements[start].pred].FT[log_distance]
+                if node == first:
+                    break
+            start = first
     
+    def remove_from_ring(self, id):
+        '''Takes a node out of the ring and returns it: its successor inherits
+        the pred link and resources, and the only FT rows fixed are the ones
+        that pointed at it, row i in the nodes of (pred - 2^i, id - 2^i]'''
+        node = self.elements[id]
+        succ = node.succ
+        if self.cache is not None:
+            self.cache.invalidate(id)
+
+        if succ == id:
+            del self.elements[id]
+            self.start_id = None
+            return node
+
+        # row 0 last: the walks below follow succ links, pred's one included
+        for i in range(self.k - 1, -1, -1):
+            # the range of nodes to fix is (low, high]
+            low = self.distance(0, node.pred - self.__2_pow[i] + 1)
+            high = self.distance(0, id - self.__2_pow[i])
+            distance = self.distance(low, high)
+            first = current = self.circular_search_on_ring(low, succ)
+
+            # the range can hold the whole ring when it is this sparse
+            while self.distance(low, current) <= distance:
+                fixed, current = self.elements[current], self.elements[current].succ
+                if fixed.FT[i] == id:
+                    fixed.FT[i] = succ
+                if current == first:
+                    break
+
+        self.elements[succ].pred = node.pred
+        self.elements[succ].pred_distance = self.distance(node.pred, succ)
+        self.elements[succ].resources.update(node.resources)
+        node.resources = {}
+        del self.elements[id]
+
+        if self.start_id == id:
+            self.start_id = succ
+        return node
+
     def _int_log2(self, distance, k):
         '''### return min(floor(log2(distance)), k) if log2(distance)>=0 else return 0'''
         for i in range(k, 0, -1):
@@ -146,12 +290,302 @@ class Ring:
         return 0
         
 
+class ArrayRing:
+    '''Read-only Ring held as numpy arrays: the sorted ids, each node's
+    pred_distance and its finger table as a (n, k) matrix of row indices
+    (finger_rows).
+    search routes whole arrays of keys at once, hop for hop like
+    Ring.circular_search_on_ring. Needs k <= 62 to fit int64.'''
+
+    def __init__(self, k, ids, table, pred_distance, start_id = None) -> None:
+        if k > 62:
+            raise ValueError('ArrayRing needs k <= 62, got {}'.format(k))
+        self.k = k
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.table = np.asarray(table)
+        self.pred_distance = np.asarray(pred_distance, dtype=np.int64)
+        self.start_id = self.ids[-1] if start_id is None else start_id
+        self.stats = None
+        self.owners = np.arange(self.ids.size)
+
+    @classmethod
+    def from_ids(cls, ids, k):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        return cls(k, ids, finger_rows(ids, k), (ids - np.roll(ids, 1)) % 2**k)
+
+    @classmethod
+    def from_peers(cls, peers, k, vnodes = 8):
+        '''Ring of `peers` peers with `vnodes` virtual nodes each, see virtual_ids'''
+        ids, owners = virtual_ids(peers, vnodes, k)
+        ring = cls(k, ids, finger_rows(ids, k), (ids - np.roll(ids, 1)) % 2**k)
+        ring.owners = owners
+        return ring
+
+    @classmethod
+    def from_ring(cls, ring):
+        '''Copies a Ring as it is, stale fingers included'''
+        ids = sorted(ring.elements)
+        nodes = [ring.elements[id] for id in ids]
+        table = np.searchsorted(ids, np.array([node.FT for node in nodes], dtype=np.int64))
+        return cls(ring.k, ids, table, [node.pred_distance for node in nodes], ring.start_id)
+
+    def __len__(self):
+        return self.ids.size
+
+    def save(self, path):
+        '''Saves the arrays in the directory `path`, see snapshot.py'''
+        save_arrays(path, {'format': 'dht.ArrayRing', 'k': self.k, 'start_id': int(self.start_id)},
+                    {'ids': self.ids, 'table': self.table, 'pred_distance': self.pred_distance, 'owners': self.owners})
+
+    @classmethod
+    def from_snapshot(cls, path, mmap = True):
+        '''ArrayRing saved by save, memory mapped read only unless mmap is False'''
+        meta, arrays = load_arrays(path, 'r' if mmap else None)
+        ring = cls(meta['k'], arrays['ids'], arrays['table'], arrays['pred_distance'], meta['start_id'])
+        ring.owners = arrays['owners']
+        return ring
+
+    def load(self, keys = ()):
+        '''load_report per owner, counting as items the `keys` each node is responsible for'''
+        rows = np.searchsorted(self.ids, np.asarray(keys, dtype=np.int64) % 2**self.k) % self.ids.size
+        return load_report(self.owners, self.pred_distance, np.bincount(rows, minlength=self.ids.size), self.k)
+
+    def search(self, keys, start = None):
+        '''Responsible node of every key and the hops taken to find it,
+        starting from `start` (default start_id)'''
+        keys = np.asarray(keys, dtype=np.int64)
+        cicle = 2**self.k
+        node = np.full(keys.shape, np.searchsorted(self.ids, self.start_id if start is None else start))
+        hops = np.zeros(keys.shape, dtype=np.int64)
+
+        if keys.size == 0 or self.pred_distance[node.flat[0]] == 0:
+            return self.ids[node], hops
+
+        # every key is routed by the same steps, only on the still active ones
+        active = np.arange(keys.size)
+        flat_keys, flat_node, flat_hops = keys.ravel(), node.ravel(), hops.ravel()
+        current, target = flat_node, flat_keys
+        i = np.full(keys.size, self.k)
+
+        while active.size:
+            ids = self.ids[current]
+            searching = (ids - target) % cicle >= self.pred_distance[current]
+            flat_node[active] = current
+            active, current, target, i, ids = (
+                x[searching] for x in (active, current, target, i, ids))
+
+            i = np.maximum(0, np.minimum(bit_length((target - ids) % cicle) - 1, i - 1))
+            current = self.table[current, i]
+            flat_hops[active] += 1
+            if self.stats is not None:
+                self.stats.rows += np.bincount(i, minlength=self.k)
+
+            # row 0 is the succ: the key is there, no need to check it
+            done = i == 0
+            flat_node[active[done]] = current[done]
+            active, current, target, i = (x[~done] for x in (active, current, target, i))
+
+        if self.stats is not None:
+            self.stats.record_many(hops)
+        return self.ids[node], hops
+
+
+class LookupStats:
+    '''Hop counts and FT rows used by the lookups of a DHT or ArrayRing, plus
+    the last `paths` routing paths (DHT only). Off unless attached:
+    dht.stats = LookupStats(k), and None again to stop.'''
+
+    def __init__(self, k, paths = 100) -> None:
+        self.k = k
+        self.lookups = 0
+        self.hops = Counter()
+        self.rows = np.zeros(k, dtype=np.int64)
+        self.paths = deque(maxlen=paths)
+
+    def record(self, t_ids, node, path, rows):
+        '''Adds one lookup and returns its node'''
+        self.lookups += 1
+        self.hops[len(rows)] += 1
+        for i in rows:
+            self.rows[i] += 1
+        self.paths.append((t_ids, path))
+        return node
+
+    def record_many(self, hops):
+        '''Adds the hop counts of a batch, its rows are counted by the caller'''
+        counts = np.bincount(np.ravel(hops))
+        self.lookups += int(counts.sum())
+        for h in np.flatnonzero(counts).tolist():
+            self.hops[h] += int(counts[h])
+
+    def percentile(self, q):
+        '''Smallest hop count reached by q% of the lookups'''
+        seen = 0
+        for h in sorted(self.hops):
+            seen += self.hops[h]
+            if seen * 100 >= q * self.lookups:
+                return h
+        return 0
+
+    def summary(self):
+        total = sum(h * count for h, count in self.hops.items())
+        return {'lookups': self.lookups,
+                'mean_hops': total / self.lookups if self.lookups else 0.0,
+                'p50_hops': self.percentile(50),
+                'p99_hops': self.percentile(99),
+                'max_hops': max(self.hops, default=0),
+                'hops': dict(sorted(self.hops.items())),
+                'rows': self.rows.tolist()}
+
+
+class LookupCache:
+    '''LRU cache of the (pred, id] intervals of the last `size` nodes found by
+    DHT lookups. A key in a cached interval is answered without routing (and
+    without being counted in DHT.stats). Attach with ring.cache = LookupCache(k);
+    the ring invalidates the interval of a node when it changes.'''
+
+    def __init__(self, k, size = 1024) -> None:
+        self.cicle = 2**k
+        self.size = size
+        self.intervals = OrderedDict()
+        self.ids = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def get(self, t_ids):
+        '''The cached node responsible for t_ids, or None'''
+        if self.ids:
+            # only the first cached id from t_ids on can hold it
+            id = self.ids[bisect_left(self.ids, t_ids) % len(self.ids)]
+            if (id - t_ids) % self.cicle < self.intervals[id]:
+                self.intervals.move_to_end(id)
+                self.hits += 1
+                return id
+        self.misses += 1
+        return None
+
+    def put(self, id, pred_distance):
+        if pred_distance == 0 or self.size <= 0:
+            return  # one node ring, nothing to route, or no room to cache
+        if id not in self.intervals:
+            insort(self.ids, id)
+        self.intervals[id] = pred_distance
+        self.intervals.move_to_end(id)
+        if len(self.intervals) > self.size:
+            self.invalidate(next(iter(self.intervals)))
+
+    def invalidate(self, id):
+        if self.intervals.pop(id, None) is not None:
+            del self.ids[bisect_left(self.ids, id)]
+
+    def clear(self):
+        self.intervals.clear()
+        self.ids = []
+
+
 class DHT:
 
     def __init__(self, k) -> None:
         self.ring = Ring(k)
         self.n = 0
+        self.stats = None
+        self.peers = []
+        self.owners = {}
+
+    @classmethod
+    def from_ids(cls, ids, k):
+        '''Builds the DHT of `ids` in bulk: the ids are sorted once and every
+        finger table comes from fingers(). Same nodes, in the same order and
+        with the same start_id, as inserting the ids one by one.'''
+        dht = cls(k)
+        order = list(dict.fromkeys(int(id) for id in ids))
+        if len(order) == 0:
+            return dht
+
+        ids = sorted(order)
+        table = fingers(ids, k).tolist()
+        rank = {id: i for i, id in enumerate(ids)}
+
+        for id in order:
+            i = rank[id]
+            pred = ids[i - 1]
+            dht.ring.elements[id] = Node(k, pred, table[i][0], dht.ring.distance(pred, id))
+            dht.ring.elements[id].FT = table[i]
+
+        dht.ring.start_id = order[-1]
+        dht.n = len(order)
+        return dht
     
+    @classmethod
+    def from_peers(cls, peers, k, vnodes = 8):
+        '''DHT where each of `peers` owns `vnodes` ring positions, see virtual_ids.
+        owners maps a position to its peer's index in peers.'''
+        ids, owners = virtual_ids(len(peers), vnodes, k)
+        dht = cls.from_ids(ids.tolist(), k)
+        dht.peers = list(peers)
+        dht.owners = dict(zip(ids.tolist(), owners.tolist()))
+        return dht
+
+    def load(self):
+        '''load_report per peer, from every node's pred_distance and resources.
+        Without virtual nodes each node is its own peer, in elements order;
+        with them a node nobody owns (inserted without an owner) is a peer of
+        its own, after the peers.'''
+        nodes = self.ring.elements
+        n = len(nodes)
+        if self.owners:
+            peers = len(self.peers)
+            owners = np.empty(n, dtype=np.int64)
+            for i, id in enumerate(nodes):
+                owners[i] = self.owners.get(id, peers)
+                peers += id not in self.owners
+        else:
+            owners, peers = np.arange(n), n
+        pred_distance = np.fromiter((node.pred_distance for node in nodes.values()), np.int64 if self.ring.k <= 62 else object, n)
+        items = np.fromiter((len(node.resources) for node in nodes.values()), np.int64, n)
+        return load_report(owners, pred_distance, items, self.ring.k, peers)
+
+    def save(self, path):
+        '''Saves the ring in the directory `path` (see snapshot.py): ids in
+        elements order with their pred, pred_distance and FT rows, the
+        owners of virtual nodes (-1 for none) and the resources as
+        (row, key, value)'''
+        nodes = list(self.ring.elements.values())
+        dtype = np.int64 if self.ring.k <= 62 else object
+        resources = [(i, key, value) for i, node in enumerate(nodes) for key, value in node.resources.items()]
+        rows, keys, values = zip(*resources) if resources else ([], [], [])
+        arrays = {'ids': np.array(list(self.ring.elements), dtype=dtype),
+                  'pred': np.array([node.pred for node in nodes], dtype=dtype),
+                  'pred_distance': np.array([node.pred_distance for node in nodes], dtype=dtype),
+                  'FT': np.array([node.FT for node in nodes], dtype=dtype).reshape(len(nodes), self.ring.k),
+                  'owners': np.array([self.owners.get(id, -1) for id in self.ring.elements] if self.owners else [], dtype=np.int64),
+                  'peers': objects(self.peers),
+                  'resource_rows': np.array(rows, dtype=np.int64),
+                  'resource_keys': objects(keys),
+                  'resource_values': objects(values)}
+        save_arrays(path, {'format': 'dht.DHT', 'k': self.ring.k, 'n': self.n, 'start_id': self.ring.start_id}, arrays)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        '''DHT saved by save'''
+        meta, arrays = load_arrays(path)
+        dht = cls(meta['k'])
+        ids = arrays['ids'].tolist()
+        for id, pred, pred_distance, FT in zip(ids, arrays['pred'].tolist(), arrays['pred_distance'].tolist(), arrays['FT'].tolist()):
+            dht.ring.elements[id] = Node(dht.ring.k, pred, FT[0], pred_distance)
+            dht.ring.elements[id].FT = FT
+        for row, key, value in zip(arrays['resource_rows'].tolist(), arrays['resource_keys'], arrays['resource_values']):
+            dht.ring.elements[ids[row]].resources[key] = value
+
+        dht.ring.start_id = meta['start_id']
+        dht.n = meta['n']
+        dht.peers = arrays['peers'].tolist()
+        dht.owners = {id: owner for id, owner in zip(ids, arrays['owners'].tolist()) if owner >= 0}
+        return dht
+
     def __str__(self) -> str:
         id = self.ring.start_id
         seen_ids = set()
@@ -167,18 +601,92 @@ class DHT:
         return self.n == 0
 
     def linear_search(self, t_ids):
-        return self.ring.linear_search_on_ring(t_ids, self.ring.start_id)
+        if self.stats is None:
+            return self.ring.linear_search_on_ring(t_ids, self.ring.start_id)
+        return self.stats.record(t_ids, *self.ring.linear_search_path(t_ids, self.ring.start_id))
     
     def linear_insert(self, id):
         self.ring.linear_insert_on_ring(id)
         self.n += 1
     
     def search(self, t_ids):
-        return self.ring.circular_search_on_ring(t_ids, self.ring.start_id)
+        return self._route(t_ids, self.ring.start_id)
+
+    def _route(self, t_ids, start):
+        cache = self.ring.cache
+        if cache is not None:
+            id = cache.get(t_ids)
+            if id is not None:
+                return id
+
+        if self.stats is None:
+            id = self.ring.circular_search_on_ring(t_ids, start)
+        else:
+            id = self.stats.record(t_ids, *self.ring.circular_search_path(t_ids, start))
+
+        if cache is not None:
+            cache.put(id, self.ring.elements[id].pred_distance)
+        return id
     
-    def insert(self, id):
+    def insert(self, id, owner = None):
+        '''Adds the node id, a virtual node of peers[owner] if owner is given'''
         self.ring.circular_insert_on_ring(id)
         self.n += 1
+        if owner is not None:
+            self.owners[id] = owner
+
+    def leave(self, id):
+        '''A node quits: it hands its resources to its successor first'''
+        self.ring.remove_from_ring(id)
+        self.n -= 1
+        self.owners.pop(id, None)
+
+    def fail(self, id):
+        '''A node crashes: the ring is repaired as for leave, and its resources
+        are recovered by the successor as if replicated there'''
+        self.ring.remove_from_ring(id)
+        self.n -= 1
+        self.owners.pop(id, None)
+
+    def position(self, key):
+        '''Ring position of a key, see key_position'''
+        return key_position(key, self.ring.k)
+
+    def put(self, key, value):
+        '''Stores value under key in the node responsible for it, returns that node'''
+        id = self.search(self.position(key))
+        self.ring.elements[id].resources[key] = value
+        return id
+
+    def get(self, key, default = None):
+        return self.ring.elements[self.search(self.position(key))].resources.get(key, default)
+
+    def delete(self, key):
+        '''Removes key from the DHT and returns its value, KeyError if missing'''
+        return self.ring.elements[self.search(self.position(key))].resources.pop(key)
+
+    def _sweep(self, keys):
+        '''Yields (index, node) for keys sorted by ring position, each search
+        starting from the node that answered the previous key'''
+        positions = [self.position(key) for key in keys]
+        id = self.ring.start_id
+        for i in sorted(range(len(keys)), key=positions.__getitem__):
+            id = self._route(positions[i], id)
+            yield i, id
+
+    def get_many(self, keys, default = None):
+        '''Values of keys, in the given order, resolved in one sweep along the ring'''
+        keys = list(keys)
+        values = [default] * len(keys)
+        for i, id in self._sweep(keys):
+            values[i] = self.ring.elements[id].resources.get(keys[i], default)
+        return values
+
+    def put_many(self, items):
+        '''Stores (key, value) pairs, or a dict, in one sweep along the ring'''
+        items = list(items.items() if isinstance(items, dict) else items)
+        for i, id in self._sweep([key for key, _ in items]):
+            self.ring.elements[id].resources[items[i][0]] = items[i][1]
 
 
 
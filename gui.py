@@ -1,11 +1,182 @@
+from queue import Empty, Queue
 from sys import exit
+from threading import Event, Lock, Thread
 from time import sleep
+import numpy as np
 import pygame
+from metrics import MetricsStream
 from nsp2p import Network
 
+class EdgeLayer:
+    '''Edges drawn over a background surface. Every pixel keeps the number of
+    edges covering it, so adding or removing an edge only repaints the
+    pixels of that edge: to the edge color while still covered, else back
+    to the background.'''
+
+    def __init__(self, bg, positions, color = (255,255,255)) -> None:
+        self.surface = bg.copy()
+        self.background = pygame.surfarray.array2d(bg)
+        self.coverage = np.zeros(bg.get_size(), dtype=np.int32)
+        self.color = self.surface.map_rgb(color)
+        self.positions = np.zeros((max(positions, default=-1) + 1, 2), dtype=np.int32)
+        for node, pos in positions.items():
+            self.positions[node] = round(pos[0]), round(pos[1])
+
+    def _pixels(self, edges):
+        '''Flat indices in coverage of the pixels of every edge, one per step
+        along its longer axis'''
+        edges = np.array(list(edges), dtype=np.int64).reshape(-1, 2)
+        if edges.size == 0:
+            return np.empty(0, dtype=np.int64)
+        ends = np.hstack((self.positions[edges[:, 0]], self.positions[edges[:, 1]]))
+        delta = ends[:, 2:] - ends[:, :2]
+        steps = np.abs(delta).max(axis=1) + 1
+        slope = (delta / np.maximum(steps - 1, 1)[:, None]).astype(np.float32)
+        i = np.arange(steps.sum(), dtype=np.float32) - np.repeat((np.cumsum(steps) - steps).astype(np.float32), steps)
+        x = np.repeat(ends[:, 0], steps) + np.rint(i * np.repeat(slope[:, 0], steps)).astype(np.int32)
+        y = np.repeat(ends[:, 1], steps) + np.rint(i * np.repeat(slope[:, 1], steps)).astype(np.int32)
+        width, height = self.coverage.shape
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        return x[inside].astype(np.int64) * height + y[inside]
+
+    def update(self, added = (), removed = ()):
+        '''Draws the added edges and erases the removed ones'''
+        gained, lost = self._pixels(added), self._pixels(removed)
+        coverage = self.coverage.reshape(-1)
+
+        if gained.size + lost.size < coverage.size // 16:
+            np.add.at(coverage, gained, 1)
+            np.subtract.at(coverage, lost, 1)
+            touched = np.sort(np.concatenate((gained, lost)))
+            touched = touched[np.r_[True, touched[1:] != touched[:-1]]] if touched.size != 0 else touched
+        else:
+            coverage += np.bincount(gained, minlength=coverage.size).astype(np.int32)
+            coverage -= np.bincount(lost, minlength=coverage.size).astype(np.int32)
+            touched = np.zeros(coverage.size, dtype=bool)
+            touched[gained] = True
+            touched[lost] = True
+            touched = np.flatnonzero(touched)
+
+        x, y = np.divmod(touched, self.coverage.shape[1])
+        pixels = pygame.surfarray.pixels2d(self.surface)
+        pixels[x, y] = np.where(self.coverage[x, y] > 0, self.color, self.background[x, y])
+        del pixels  # unlocks the surface
+
+
+class Snapshot:
+    '''State of the simulation published for the renderer, never modified
+    once published. `version` changes only when the edges do.'''
+
+    def __init__(self, version, path, avg_distance, tests, record) -> None:
+        self.version = version
+        self.path = path
+        self.avg_distance = avg_distance
+        self.tests = tests
+        self.record = record
+
+
+class Simulation(Thread):
+    '''Runs the network in the background as fast as it can (or every `delay`
+    seconds, out of fast mode) and publishes a Snapshot after every step.
+    Only this thread touches the network once started.'''
+
+    def __init__(self, net, fast_mode = False) -> None:
+        super().__init__(daemon=True)
+        self.net = net
+        self.net.metrics = MetricsStream(size=16)
+        self.net.link_log = []
+        self.delay = 0
+        self.pause = False
+        self.fast_mode = fast_mode
+        self.commands = Queue()
+        self.stopped = Event()
+        self._lock = Lock()
+        self._version = 0
+        # directed links behind every undirected edge, and the edge changes
+        # the renderer has not taken yet: at first, every edge
+        self._links = {}
+        for a, b in net.edges:
+            self._links[(a, b)] = (b in net.elements[a].links) + (a in net.elements[b].links)
+        self._added, self._removed = set(self._links), set()
+        self._publish(None)
+
+    @property
+    def latest(self):
+        with self._lock:
+            return self._snapshot
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                command = self.commands.get(timeout=0.05 if self.pause else 0)
+            except Empty:
+                command = None
+
+            if command == 'evolve':
+                self.evolve()
+            if command == 'step' or (command is None and not self.pause):
+                self.step()
+                if not self.fast_mode and self.delay:
+                    sleep(self.delay)
+
+    def step(self):
+        if self.net.tests >= 1000:
+            self.evolve()
+
+        path = None
+        if self.fast_mode:
+            self.net.simulate(1000, batch_size=1000)
+        else:
+            path = self.net.random_bfs(max_depth=4)
+        self._publish(path)
+
+    def evolve(self):
+        self.net.evolve()
+        self.net.integrity_check()
+        log, self.net.link_log = self.net.link_log, []
+
+        existed = {}
+        for node, link, sign in log:
+            edge = (min(node, link), max(node, link))
+            count = self._links.get(edge, 0)
+            existed.setdefault(edge, count > 0)
+            self._links[edge] = count + sign
+
+        # an edge can go and come back within the same evolve
+        added = {edge for edge, was in existed.items() if not was and self._links[edge] > 0}
+        removed = {edge for edge, was in existed.items() if was and self._links[edge] == 0}
+        for edge in existed:
+            if self._links[edge] == 0:
+                del self._links[edge]
+
+        with self._lock:
+            self._added, self._removed = (self._added - removed) | (added - self._removed), \
+                                         (self._removed - added) | (removed - self._added)
+        self._version += 1
+        self._publish(None)
+
+    def take_changes(self):
+        '''(added, removed) edges since the last call'''
+        with self._lock:
+            changes = self._added, self._removed
+            self._added, self._removed = set(), set()
+        return changes
+
+    def _publish(self, path):
+        records = self.net.metrics.records
+        snapshot = Snapshot(self._version, path, self.net.avg_distance,
+                            self.net.tests, records[-1] if records else None)
+        with self._lock:
+            self._snapshot = snapshot
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
 class NetGui:
 
-    def __init__(self, v, l) -> None:
+    def __init__(self, v, l, fps = 60) -> None:
         pygame.init()
         pygame.display.set_caption("NetSim")
         self.screen = pygame.display.set_mode((800, 600))
@@ -14,73 +185,87 @@ class NetGui:
         self.net = Network(v, l)
         self.elements = {}
         self.bg = self._nodes_surface()
-        self.bg_wedges = self._draw_edges(self.bg.copy(), self.net.edges)
+        self.simulation = Simulation(self.net)
+        self.snapshot = self.simulation.latest
+        self.edge_layer = EdgeLayer(self.bg, self.elements)
+        self.edge_layer.update(*self.simulation.take_changes())
         self.clean = 1
         self.FONT = pygame.font.SysFont('monospace', 20)
-        self.delay = 0
-        self.pause = False
+        self.texts = {}
+        self.clock = pygame.time.Clock()
+        self.fps = fps
         self.show_edges = True
-        self.fast_mode = False
-    
+
     def main_loop(self):
+        self.simulation.start()
         while True:
             self._handle_input()
-            if not self.pause: self._process_logic()
+            self._process_logic()
             self._draw()
-            sleep(self.delay)
+            self.clock.tick(self.fps)
 
     def _handle_input(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                self.simulation.stop()
                 pygame.quit()
                 exit()
-            
+
             if event.type == pygame.KEYDOWN:
                 match event.key:
                     case pygame.K_RETURN:
-                        self.evolve()
+                        self.simulation.commands.put('evolve')
                     case pygame.K_UP:
-                        self.delay += 0.1
+                        self.simulation.delay += 0.1
                     case pygame.K_DOWN:
-                        self.delay = self.delay - 0.1 if self.delay > 0.1 else 0
+                        self.simulation.delay = self.simulation.delay - 0.1 if self.simulation.delay > 0.1 else 0
                     case pygame.K_SPACE:
-                        self.pause = self.pause == False
+                        self.simulation.pause = self.simulation.pause == False
                     case pygame.K_RIGHT:
-                        self._process_logic()
+                        self.simulation.commands.put('step')
                     case pygame.K_h:
                         self.show_edges = self.show_edges == False
                     case pygame.K_f:
-                        self.fast_mode = self.fast_mode == False
+                        self.simulation.fast_mode = self.simulation.fast_mode == False
 
     def _process_logic(self):
-        if self.net.tests >= 1000:
-            self.evolve()
-        
-        if self.fast_mode:
-            self.net.simulate(1000)
-        else:
-            self.path = self.net.random_bfs(max_depth=4)
+        '''Takes the newest snapshot, redrawing the edges only if they changed'''
+        snapshot = self.simulation.latest
+        if snapshot.version != self.snapshot.version:
+            self.edge_layer.update(*self.simulation.take_changes())
+        self.snapshot = snapshot
 
     def _draw(self):
         # if self.clean == 1:
         self.screen.fill((0,0,0))
-        
+
         if self.show_edges:
-            self.screen.blit(self.bg_wedges, (0,0))
+            self.screen.blit(self.edge_layer.surface, (0,0))
         else:
             self.screen.blit(self.bg, (0,0))
-        
-        if not self.fast_mode and self.path is not None:
-            self._draw_node(self.elements[self.path[0]], (0,0,255))
-            self._draw_node(self.elements[self.path[-1]], (255,0,0))
-            self._draw_edges(self.screen, zip(self.path[:-1], self.path[1:]), (0,255,0), 2)
-        
-        self.screen.blit(self.FONT.render('avg dist: '+str(self.net.avg_distance), False, (255,255,255)), (600,50))
-        self.screen.blit(self.FONT.render('tests: '+str(self.net.tests), False, (255,255,255)), (600,80))
-        self.screen.blit(self.FONT.render('delay: {:.1f}'.format(self.delay), False, (255,255,255)), (20,50))
-        
+
+        path = self.snapshot.path
+        if path is not None:
+            self._draw_node(self.elements[path[0]], (0,0,255))
+            self._draw_node(self.elements[path[-1]], (255,0,0))
+            self._draw_edges(self.screen, zip(path[:-1], path[1:]), (0,255,0), 2)
+
+        self._text('avg dist: '+str(self.snapshot.avg_distance), (600,50))
+        self._text('tests: '+str(self.snapshot.tests), (600,80))
+        if self.snapshot.record is not None:
+            self._text('found: {:.0%}'.format(self.snapshot.record['success_rate']), (600,110))
+        self._text('delay: {:.1f}'.format(self.simulation.delay), (20,50))
+        self._text('fps: {:.0f}'.format(self.clock.get_fps()), (20,80))
+
         pygame.display.flip()
 
+    def _text(self, string, pos):
+        '''Blits string at pos, rendering it again only when it changed'''
+        cached = self.texts.get(pos)
+        if cached is None or cached[0] != string:
+            cached = self.texts[pos] = string, self.FONT.render(string, False, (255,255,255))
+        self.screen.blit(cached[1], pos)
+
     def _nodes_surface(self):
         cursor = pygame.math.Vector2((-260, 0))
         angle = 360/len(self.net.elements)
@@ -89,19 +274,17 @@ class NetGui:
             self.elements[node] = self.center + cursor
             self._draw_node(self.elements[node])
             cursor = cursor.rotate(angle)
-        
+
         return self.screen.copy()
-    
+
     def _draw_node(self, pos, color = (255, 255, 255)):
         pygame.draw.circle(self.screen, color, pos, 2)
-    
+
     def _draw_edges(self, surface, edges, color = (255,255,255), width = 1):
         for edge in edges:
             pygame.draw.line(surface, color, self.elements[edge[0]], self.elements[edge[1]], width)
-        
+
         return surface
-    
+
     def evolve(self):
-        self.net.evolve()
-        self.net.integrity_check()
-        self.bg_wedges = self._draw_edges(self.bg.copy(), self.net.edges)
+        self.simulation.commands.put('evolve')
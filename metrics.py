@@ -0,0 +1,83 @@
+'''Per epoch metrics of a nsp2p.Network, streamed to a bounded buffer and
+optionally appended to a CSV or JSONL file'''
+from collections import deque
+import csv
+import json
+import os
+from time import time
+import numpy as np
+
+class MetricsStream:
+    '''Attach with net.metrics = MetricsStream(). The network then reports
+    every lookup, the repairs of integrity_check and, at each evolve, the
+    links it changed: evolve closes the epoch and emits its record. Repairs
+    made after an evolve count in the next epoch, the one they affect.
+
+    The last `size` records are kept in `records`; with `sink` (a .csv or
+    .jsonl path) every record is also appended there. Histograms are lists
+    indexed by depth or degree, json encoded in CSV cells.'''
+
+    fields = ('epoch', 'time', 'lookups', 'found', 'success_rate', 'avg_depth', 'depths',
+              'peers', 'degree_mean', 'degree_max', 'degrees', 'edges_changed', 'repairs')
+
+    def __init__(self, size = 1024, sink = None) -> None:
+        self.records = deque(maxlen=size)
+        self.sink = sink
+        if sink is not None and os.path.splitext(sink)[1] not in ('.csv', '.jsonl'):
+            raise ValueError('sink must be a .csv or .jsonl file: {}'.format(sink))
+        self.epoch = 0
+        self._reset()
+
+    def _reset(self):
+        self.lookups = 0
+        self.depths = [0]
+        self.repairs = 0
+
+    def lookup(self, path):
+        '''One search, path None when it failed'''
+        self.lookups += 1
+        if path is not None:
+            depth = len(path) - 1
+            if depth >= len(self.depths):
+                self.depths += [0] * (depth + 1 - len(self.depths))
+            self.depths[depth] += 1
+
+    def lookup_many(self, paths):
+        for path in paths:
+            self.lookup(path)
+
+    def repaired(self, count):
+        self.repairs += count
+
+    def close_epoch(self, degrees, edges_changed):
+        '''Emits the record of the epoch, `degrees` being the peers' out-degrees'''
+        found = sum(self.depths)
+        degrees = np.asarray(degrees)
+        record = {'epoch': self.epoch, 'time': time(), 'lookups': self.lookups, 'found': found,
+                  'success_rate': found / self.lookups if self.lookups else 0.0,
+                  'avg_depth': sum(d * n for d, n in enumerate(self.depths)) / found if found else 0.0,
+                  'depths': list(self.depths),
+                  'peers': int(degrees.size),
+                  'degree_mean': float(degrees.mean()) if degrees.size else 0.0,
+                  'degree_max': int(degrees.max()) if degrees.size else 0,
+                  'degrees': np.bincount(degrees).tolist(),
+                  'edges_changed': int(edges_changed), 'repairs': self.repairs}
+
+        self.records.append(record)
+        if self.sink is not None:
+            self._write(record)
+        self.epoch += 1
+        self._reset()
+        return record
+
+    def _write(self, record):
+        new = not os.path.exists(self.sink) or os.path.getsize(self.sink) == 0
+        with open(self.sink, 'a', newline='') as file:
+            if self.sink.endswith('.jsonl'):
+                file.write(json.dumps(record) + '\n')
+                return
+            writer = csv.writer(file)
+            if new:
+                writer.writerow(self.fields)
+            writer.writerow([json.dumps(record[field]) if isinstance(record[field], list) else record[field]
+                             for field in self.fields])
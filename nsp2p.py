@@ -1,11 +1,162 @@
+from collections import deque
+from collections.abc import Mapping
+import heapq
+import os
 import numpy as np
+from snapshot import load_arrays, save_arrays
+
+def id_dtype(v):
+    '''Smallest unsigned dtype able to hold the ids 0..v-1'''
+    return np.min_scalar_type(max(v - 1, 0))
+
+def ring_graph(v, l):
+    '''Random ring of v peers where every peer links its pred, its succ and
+    l distinct random peers other than those three. Returns the ring order
+    and a (v, l+2) matrix whose i-th row holds the links of values[i].'''
+    if l > v - 3:
+        raise ValueError('cannot pick {} long links among {} peers'.format(l, max(v - 3, 0)))
+
+    dtype = id_dtype(v)
+    values = np.random.permutation(v).astype(dtype)
+    i = np.arange(v)
+
+    # Long links are drawn as offsets in [0, v-3) from the succ of succ,
+    # so they can never hit the peer itself, its pred or its succ
+    if l == 0:
+        offsets = np.empty((v, 0), dtype=np.int64)
+    elif 2 * l > v - 3:
+        offsets = np.argsort(np.random.random((v, v - 3)), axis=1)[:, :l]
+    else:
+        offsets = np.random.randint(0, v - 3, size=(v, l))
+        redraw = i
+        while redraw.size != 0:
+            ordered = np.sort(offsets[redraw], axis=1)
+            redraw = redraw[(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)]
+            offsets[redraw] = np.random.randint(0, v - 3, size=(redraw.size, l))
+
+    links = np.empty((v, l + 2), dtype=dtype)
+    links[:, 0] = values[(i - 1) % v]
+    links[:, 1] = values[(i + 1) % v]
+    links[:, 2:] = values[(i[:, None] + 2 + offsets) % v]
+    return values, links
+
+def gather(offsets, nodes):
+    '''Flat CSR indices of the links of `nodes`, row after row, and the row lengths'''
+    starts = offsets[nodes]
+    counts = offsets[nodes + 1] - starts
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(shift.size), counts
+
+def short_cycles(offsets, neighbors, nodes, length):
+    '''Flags, indexed by id, of the `nodes` lying on a cycle of at most
+    `length` links, found for all of them at once by extending paths one
+    link at a time and looking up the link that would close them'''
+    size = offsets.size - 1
+    owner = np.repeat(np.arange(size), np.diff(offsets))
+    links = np.sort(owner * size + neighbors)
+    passed = np.zeros(size, dtype=bool)
+    step = max(1, 2**22 // max(int(np.diff(offsets).max(initial=0)) ** max(length - 1, 0), 1))
+
+    for i in range(0, nodes.size, step):
+        source = end = nodes[i:i+step]
+
+        for hops in range(1, length + 1):
+            passed[source[contains(links, end * size + source)]] = True
+            if hops == length:
+                break
+            keep = ~passed[source]
+            index, counts = gather(offsets, end[keep])
+            source, end = np.repeat(source[keep], counts), neighbors[index]
+
+    return passed
+
+def distinct(keys):
+    '''Sorted distinct values of keys'''
+    keys = np.sort(keys)
+    return keys[np.r_[True, keys[1:] != keys[:-1]]] if keys.size != 0 else keys
+
+def contains(table, keys):
+    '''Flags of the keys found in the sorted array table'''
+    if table.size == 0:
+        return np.zeros(keys.size, dtype=bool)
+    return table[np.minimum(np.searchsorted(table, keys), table.size - 1)] == keys
+
+def reverse(offsets, neighbors):
+    '''CSR of the reversed links: row `id` holds the peers linking id'''
+    size = offsets.size - 1
+    owner = np.repeat(np.arange(size), np.diff(offsets))
+    in_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(neighbors, minlength=size), out=in_offsets[1:])
+    return in_offsets, owner[np.argsort(neighbors, kind='stable')]
+
+def ball(offsets, neighbors, nodes, radius, include_start = True):
+    '''Keys query * size + peer of every peer within `radius` links of
+    nodes[query], with their distance. Without include_start the start is
+    not marked as seen, so it shows up again at the length of its cycle.'''
+    size = offsets.size - 1
+    query = np.arange(nodes.size)
+    seen = query * size + nodes if include_start else np.empty(0, dtype=np.int64)
+    keys, distances = [seen], [np.zeros(seen.size, dtype=np.int64)]
+    frontier = nodes
+
+    for distance in range(1, radius + 1):
+        index, counts = gather(offsets, frontier)
+        level = distinct(np.repeat(query, counts) * size + neighbors[index])
+        level = level[~contains(seen, level)]
+        seen = np.insert(seen, np.searchsorted(seen, level), level)
+        query, frontier = np.divmod(level, size)
+        keys.append(level)
+        distances.append(np.full(level.size, distance, dtype=np.int64))
+
+    return np.concatenate(keys), np.concatenate(distances)
+
+def cycles_within(offsets, neighbors, nodes, length):
+    '''Flags, indexed by id, of the `nodes` lying on a cycle of at most
+    `length` links. The forward ball of radius ceil(length/2) and the
+    backward ball of radius floor(length/2) of a peer share a peer m with
+    d(n, m) + d(m, n) <= length exactly when such a cycle exists.'''
+    size = offsets.size - 1
+    in_offsets, in_neighbors = reverse(offsets, neighbors)
+    passed = np.zeros(size, dtype=bool)
+    forward, backward = (length + 1) // 2, length // 2
+    step = max(1, 2**22 // max(int(np.diff(offsets).max(initial=0)) ** forward, 1))
+
+    for i in range(0, nodes.size, step):
+        chunk = nodes[i:i+step]
+        out_keys, out_distance = ball(offsets, neighbors, chunk, forward, include_start=False)
+        in_keys, in_distance = ball(in_offsets, in_neighbors, chunk, backward)
+        common, a, b = np.intersect1d(out_keys, in_keys, assume_unique=True, return_indices=True)
+        close = out_distance[a] + in_distance[b] <= length
+        passed[chunk[common[close] // size]] = True
+
+    return passed
+
+def on_cycle(offsets, neighbors, nodes):
+    '''Flags, indexed by id, of the `nodes` that may lie on a cycle: peers
+    nobody links or linking nobody are trimmed away until none is left.
+    Every peer on a cycle survives, a few others may too.'''
+    size = offsets.size - 1
+    in_offsets, in_neighbors = reverse(offsets, neighbors)
+    alive = np.zeros(size, dtype=bool)
+    alive[nodes] = True
+    in_degree = np.diff(in_offsets)
+    out_degree = np.diff(offsets)
+    removed = np.flatnonzero(alive & ((in_degree == 0) | (out_degree == 0)))
+
+    while removed.size != 0:
+        alive[removed] = False
+        in_degree -= np.bincount(neighbors[gather(offsets, removed)[0]], minlength=size)
+        out_degree -= np.bincount(in_neighbors[gather(in_offsets, removed)[0]], minlength=size)
+        removed = np.flatnonzero(alive & ((in_degree == 0) | (out_degree == 0)))
+
+    return alive
 
 class Queue:
     def __init__(self) -> None:
-        self.queue = []
+        self.queue = deque()
     
     def __repr__(self) -> str:
-        return 'Queue' + str(self.queue)
+        return 'Queue' + str(list(self.queue))
     
     def is_empty(self):
         return len(self.queue) == 0
@@ -14,43 +165,97 @@ class Queue:
         self.queue.append(__value)
     
     def read(self):
-        return self.queue.pop(0)
+        return self.queue.popleft()
     
     def reset(self):
-        self.queue = []
+        self.queue = deque()
     
     def copy(self):
         new_queue = Queue()
         new_queue.queue = self.queue.copy()
         return new_queue
 
+def select(n, items, key, reverse = False):
+    '''sorted(items, key=key, reverse=reverse)[:n]: a heap selection when n is
+    small against the list, a plain sort (faster in C) otherwise'''
+    if len(items) > 16 * n:
+        return heapq.nlargest(n, items, key=key) if reverse else heapq.nsmallest(n, items, key=key)
+    return sorted(items, key=key, reverse=reverse)[:n]
+
 class Node:
+    '''`links` and `quality` are parallel lists. A link -> slot dict, rebuilt
+    only when the links are replaced, makes increment_quality O(1); update
+    selects its best candidates and worst slots once instead of rescanning
+    the qualities for every candidate.'''
+
+    __slots__ = ('_links', '_slot', 'quality', 'candidates')
+
     def __init__(self, links: list[int] = []):
-        self.links = links
+        self.links = list(links)
         self.quality = [0] * len(links)
-        self.father = None
         self.candidates = []
     
     def __repr__(self) -> str:
         return str(self.links)
+
+    @property
+    def links(self):
+        return self._links
+
+    @links.setter
+    def links(self, links):
+        self._links = links
+        self._slot = None
+
+    def _slots(self):
+        '''link -> index of its first occurrence'''
+        if self._slot is None:
+            self._slot = {}
+            for i, link in enumerate(self._links):
+                self._slot.setdefault(link, i)
+        return self._slot
     
     def sort(self, reverse = True) -> None:
+        if len(self._links) == 0:
+            return
         links, quality = zip(*sorted(zip(self.links, self.quality), key=lambda x: x[1], reverse=reverse))
         self.links, self.quality = list(links), list(quality)
 
+    def add_link(self, link, quality = 0):
+        self._links.append(link)
+        self.quality.append(quality)
+        if self._slot is not None:
+            self._slot.setdefault(link, len(self._links) - 1)
+
+    def remove_link(self, link):
+        '''Drops every occurrence of link'''
+        keep = [i for i, x in enumerate(self._links) if x != link]
+        self.links = [self._links[i] for i in keep]
+        self.quality = [self.quality[i] for i in keep]
+
     def increment_quality(self, link, amount = 1):
-        self.quality[self.links.index(link)] += amount
+        i = self._slots().get(link)
+
+        if i is None or i >= len(self._links) or self._links[i] != link:
+            # the list was changed in place, rebuild the index
+            self._slot = None
+            i = self._slots().get(link)
+            if i is None:
+                raise ValueError('{} is not a link'.format(link))
+
+        self.quality[i] += amount
 
     def update(self, l, n = 3):
-        self.candidates = sorted(self.candidates, reverse=True, key=lambda x: x[1])[:n]
-        
-        for i in range(len(self.candidates)):
-            worst = min(self.quality)
+        self.candidates = select(n, self.candidates, key=lambda x: x[1], reverse=True)
 
-            if worst < self.candidates[i][1]:
-                j = self.quality.index(worst)
-                self.links[j] = self.candidates[i][0]
-                self.quality[j] = self.candidates[i][1]
+        # The i-th best candidate can only replace the i-th worst slot (first
+        # index on ties): every replacement is better than the slots left
+        worst = select(len(self.candidates), range(len(self.links)), key=self.quality.__getitem__)
+        
+        for (link, quality), j in zip(self.candidates, worst):
+            if self.quality[j] < quality:
+                self._links[j] = link
+                self.quality[j] = quality
             else:
                 break
         
@@ -60,15 +265,46 @@ class Node:
 
     def reset(self):
         self.candidates = []
-        self.quality = [0] * len(self.quality)
+        self.quality = [0] * len(self.links)
 
 class Network:
 
-    def __init__(self, v = 256, l = 8):
+    def __new__(cls, v = 256, l = 8, engine = 'dict'):
+        '''`engine` selects the storage: 'dict' keeps a Node object per peer,
+        'csr' keeps everything in contiguous arrays (see CSRNetwork)'''
+        if engine not in ('dict', 'csr'):
+            raise ValueError('unknown engine: {}'.format(engine))
+        if cls is Network and engine == 'csr':
+            cls = CSRNetwork
+        return super().__new__(cls)
+
+    # bytes of per-query search state a bfs_batch chunk may use
+    batch_memory = 2**26
+    # a metrics.MetricsStream to report to, None for no metrics
+    metrics = None
+    # a list to append every (peer, link, +1 or -1) to when a peer gains or
+    # loses a link in evolve or integrity_check, None for no log
+    link_log = None
+    # a routing.RoutingIndex answering search, None to search every time
+    routes = None
+    # changes whenever links are added or removed
+    version = 0
+    # the enabled profiling.Profiler, timing the phases of evolve and
+    # integrity_check, None when profiling is off
+    profiler = None
+
+    def __init__(self, v = 256, l = 8, engine = 'dict'):
         self.elements = {}
         self.l = l
         self.avg_distance = 0
         self.tests = 0
+        self._snapshot = None
+        self._dirty = set()         # peers whose quality or links changed since the last evolve
+        self._rank = {}             # insertion order of every peer
+        self._inlinks = {}          # peer -> set of the peers linking it
+        self._joined = 0            # peers added so far, the next rank
+        self._next_id = 0           # smallest id never used
+        self._free = []             # ids of the peers that left, reused first
         self.init_graph(v, l)
     
     def __repr__(self) -> str:
@@ -103,29 +339,85 @@ class Network:
         return sorted(edges)
 
     def init_graph(self, v, l):
-        ids = np.arange(v, dtype=np.uint8)
-        values = np.random.choice(ids, size=v, replace=False)
+        values, links = ring_graph(v, l)
+        self._add_peers(values.tolist(), links.tolist())
+
+    def _add_peers(self, nodes, rows, qualities = None):
+        '''Adds the peers `nodes` with the links in `rows`, in order'''
+        for i, (node, row) in enumerate(zip(nodes, rows)):
+            self.elements[node] = Node(row)
+            if qualities is not None:
+                self.elements[node].quality = qualities[i]
+            self._rank[node] = self._joined
+            self._joined += 1
+            self._next_id = max(self._next_id, node + 1)
+            self._inlinks.setdefault(node, set())
+            for link in row:
+                self._inlinks.setdefault(link, set()).add(node)
+        self.version += 1
+
+    def save(self, path):
+        '''Saves the network in the directory `path` (see snapshot.py) as the
+        arrays of a CSRNetwork, plus the peers evolve still has to visit'''
+        net = CSRNetwork.from_network(self)
+        save_arrays(path, net._meta('dict'), dict(net._arrays(), dirty=np.array(sorted(self._dirty), dtype=np.int64)))
+
+    @classmethod
+    def from_snapshot(cls, path, engine = None, mmap = True):
+        '''Network saved by save, with the saved engine unless another is
+        given. With mmap the arrays are mapped copy on write: a csr network
+        loads without reading them, the dict engine still builds its Nodes.'''
+        meta, arrays = load_arrays(path, 'c' if mmap else None)
+        net = Network.__new__(Network, engine=meta['engine'] if engine is None else engine)
+        net.l, net.avg_distance, net.tests = meta['l'], meta['avg_distance'], meta['tests']
+        net._unpack(arrays['order'], arrays['offsets'], arrays['neighbors'], arrays['quality'], arrays.get('dirty'))
+        return net
+
+    def _unpack(self, order, offsets, neighbors, quality, dirty = None):
+        '''Replaces the peers with the CSR arrays of a snapshot. Without the
+        dirty peers every peer is dirty, which evolves the same.'''
+        self.elements = {}
+        self._snapshot = None
+        self._rank = {}
+        self._inlinks = {}
+        self._joined = 0
+        self._next_id = 0
+        offsets, neighbors, quality = offsets.tolist(), neighbors.tolist(), quality.tolist()
+        nodes = order.tolist()
+        self._add_peers(nodes, [neighbors[offsets[node]:offsets[node+1]] for node in nodes],
+                        [quality[offsets[node]:offsets[node+1]] for node in nodes])
+        self._free = [node for node in range(self._next_id) if node not in self.elements]
+        self._dirty = set(nodes) if dirty is None else set(dirty.tolist())
 
-        for i in ids:
-            node = values[i]
-            pred_succ = [values[(i-1) % v], values[(i+1) % v]]
-            mask = (values!=node)*(values!=pred_succ[0])*(values!=pred_succ[1])
-            links = np.random.choice(values[mask], l, replace=False)
-            self.elements[node] = Node(pred_succ + list(links))
-    
     def bfs(self, start, searched, max_depth = 4):
+        path = self.search(start, searched, max_depth)
+        if self.metrics is not None:
+            self.metrics.lookup(path)
+
+        if path is None:
+            return None
+
+        return self.quality_update(path)
+
+    def search(self, start, searched, max_depth = 4):
+        '''The search behind bfs, without side effects: returns the path found
+        or None. Fathers are kept per call, so any number of searches can run
+        on the same network at once.'''
+        if self.routes is not None:
+            return self.routes.search(self, start, searched, max_depth)
         node = start
         depth = 0
         queue1 = Queue()
         queue2 = Queue()
         visited = set()
+        father = {}
 
         while (depth<=max_depth):
 
             for link in self.elements[node].links:
                 if link not in visited:
                     queue2.insert(link)
-                    self.elements[link].father = node
+                    father[link] = node
                     visited.add(link)
             
             if queue1.is_empty():
@@ -142,31 +434,181 @@ class Network:
         if node != searched:
             return None
         
-        return self.quality_update(node, start, depth)
-    
-    def quality_update(self, node, start, depth):
         path = [node]
-        node = self.elements[node].father
+        node = father[node]
 
         while node != start:
-            self.elements[node].increment_quality(path[0], 1)
             path.insert(0, node)
-            node = self.elements[node].father
-        
+            node = father[node]
+
         path.insert(0, node)
+        return path
+    
+    def quality_update(self, path):
+        '''Every peer in the middle of the path rewards its link to the next one'''
+        for node, link in zip(path[1:-1], path[2:]):
+            self.elements[node].increment_quality(link, 1)
+            self._dirty.add(node)
         
-        self.avg_distance = (self.avg_distance * self.tests + depth) / (self.tests + 1)
+        self.avg_distance = (self.avg_distance * self.tests + len(path) - 1) / (self.tests + 1)
         self.tests += 1
         
         return path
 
+    def _adjacency(self):
+        '''(peers, offsets, neighbors): the peers in insertion order and a CSR
+        copy of their links indexed by id. Cached until the links change.'''
+        if self._snapshot is None:
+            peers = np.array(list(self.elements), dtype=np.int64)
+            size = int(peers.max()) + 1 if peers.size != 0 else 0
+            degree = np.zeros(size, dtype=np.int64)
+            degree[peers] = [len(self.elements[node].links) for node in self.elements]
+            offsets = np.zeros(size + 1, dtype=np.int64)
+            np.cumsum(degree, out=offsets[1:])
+            neighbors = np.empty(offsets[-1], dtype=np.int64)
+            for node in self.elements:
+                neighbors[offsets[node]:offsets[node+1]] = self.elements[node].links
+            self._snapshot = peers, offsets, neighbors
+        return self._snapshot
+
+    def reach(self, start):
+        '''Number of peers reachable from start following the links'''
+        _, offsets, neighbors = self._adjacency()
+        visited = np.zeros(offsets.size - 1, dtype=bool)
+        visited[start] = True
+        frontier = np.array([start], dtype=np.int64)
+
+        while frontier.size != 0:
+            links = distinct(neighbors[gather(offsets, frontier)[0]])
+            frontier = links[~visited[links]]
+            visited[frontier] = True
+
+        return int(visited.sum())
+
     def random_bfs(self, max_depth = 4):
-        values = np.array(list(self.elements))
+        values = self._adjacency()[0]
         start = np.random.choice(values)
         searched = np.random.choice(values) # (values[values!=start])   !!
         return self.bfs(start, searched, max_depth)
 
-    def simulate(self, iterations = 100, max_depth = 4, verbose = False):
+    def bfs_batch(self, starts, searched, max_depth = 4):
+        '''Runs bfs for every (starts[i], searched[i]) pair at once, one frontier
+        per level for all the queries. Returns the same paths (None when not
+        found) and applies the same quality and avg_distance/tests updates.'''
+        _, offsets, neighbors = self._adjacency()
+        starts = np.asarray(starts, dtype=np.int64)
+        searched = np.asarray(searched, dtype=np.int64)
+        step = max(1, self.batch_memory // (17 * max(offsets.size - 1, 1)))
+        paths = []
+
+        for i in range(0, starts.size, step):
+            paths += self._bfs_chunk(offsets, neighbors, starts[i:i+step], searched[i:i+step], max_depth)
+
+        if self.metrics is not None:
+            self.metrics.lookup_many(paths)
+        self._quality_update_batch([path for path in paths if path is not None])
+        return paths
+
+    def _bfs_chunk(self, offsets, neighbors, starts, searched, max_depth):
+        size = offsets.size - 1
+        cells = starts.size * size
+        visited = np.zeros(cells, dtype=bool)
+        claim = np.empty(cells, dtype=np.int64)
+        father = np.empty(cells, dtype=np.int64)
+        query = np.arange(starts.size)
+        frontier = starts
+        found = np.zeros(starts.size, dtype=np.int64)
+        depth = 0
+
+        while depth <= max_depth and frontier.size != 0:
+            index, counts = gather(offsets, frontier)
+            links = neighbors[index]
+            owner = np.repeat(query, counts)
+            keys = owner * size + links
+
+            # first occurrence of every new (query, node): with repeated
+            # indices the last assignment wins, so assign in reverse
+            fresh = np.flatnonzero(~visited[keys])
+            claim[keys[fresh[::-1]]] = fresh[::-1]
+            first = fresh[claim[keys[fresh]] == fresh]
+            visited[keys[first]] = True
+            father[keys[first]] = np.repeat(frontier, counts)[first]
+            query, frontier = owner[first], links[first]
+            depth += 1
+
+            # queries stay grouped and in visiting order, so the first entry
+            # of a query is its first node of the level
+            hit = frontier == searched[query]
+            if depth > max_depth:
+                hit[1:] &= query[1:] != query[:-1]
+            found[query[hit]] = depth
+            keep = found[query] == 0
+            query, frontier = query[keep], frontier[keep]
+
+        # walk the fathers back from every searched node that was found
+        hits = np.flatnonzero(found)
+        table = np.zeros((hits.size, max_depth + 2), dtype=np.int64)
+        table[np.arange(hits.size), found[hits]] = searched[hits]
+        node = searched[hits]
+
+        for level in range(int(found.max()) if hits.size != 0 else 0, 0, -1):
+            active = found[hits] >= level
+            node[active] = father[hits[active] * size + node[active]]
+            table[active, level - 1] = node[active]
+
+        paths = [None] * starts.size
+        for i, row, depth in zip(hits.tolist(), table.tolist(), found[hits].tolist()):
+            paths[i] = row[:depth + 1]
+        return paths
+
+    def search_many(self, starts, searched, max_depth = 4, executor = None, chunks = None):
+        '''Runs search on every (starts[i], searched[i]) pair, optionally spread
+        over a concurrent.futures executor in `chunks` parts (one per CPU by
+        default), then merges the quality updates of all the paths found.
+        A process pool receives a pickled copy of the network for every part.'''
+        pairs = list(zip(starts, searched))
+
+        if executor is None:
+            paths = self._search_all(pairs, max_depth)
+        else:
+            size = -(-len(pairs) // (chunks or os.cpu_count() or 1)) or 1
+            parts = [pairs[i:i+size] for i in range(0, len(pairs), size)]
+            paths = [path for part in executor.map(self._search_all, parts, [max_depth] * len(parts)) for path in part]
+
+        if self.metrics is not None:
+            self.metrics.lookup_many(paths)
+        self._quality_update_batch([path for path in paths if path is not None])
+        return paths
+
+    def _search_all(self, pairs, max_depth):
+        return [self.search(start, searched, max_depth) for start, searched in pairs]
+
+    def _quality_update_batch(self, paths):
+        '''quality_update for many found paths'''
+        for path in paths:
+            for node, link in zip(path[1:-1], path[2:]):
+                self.elements[node].increment_quality(link, 1)
+                self._dirty.add(node)
+
+        if len(paths) != 0:
+            depths = sum(len(path) - 1 for path in paths)
+            self.avg_distance = (self.avg_distance * self.tests + depths) / (self.tests + len(paths))
+            self.tests += len(paths)
+
+    def simulate(self, iterations = 100, max_depth = 4, verbose = False, batch_size = None):
+        '''With `batch_size` the random searches are drawn and answered
+        `batch_size` at a time by bfs_batch'''
+        if batch_size is not None:
+            values = self._adjacency()[0]
+            for done in range(0, iterations, batch_size):
+                n = min(batch_size, iterations - done)
+                paths = self.bfs_batch(np.random.choice(values, n), np.random.choice(values, n), max_depth)
+
+                if verbose == True:
+                    for path in paths:
+                        print('random path:',path)
+            return
+
         for _ in range(iterations):
             path = self.random_bfs(max_depth)
 
@@ -174,39 +616,193 @@ class Network:
                 print('random path:',path)
     
     def evolve(self, n_share = 3):
+        '''Only peers whose quality or links changed since the last cycle can
+        end up with different links: the others have all-zero quality, so
+        they neither offer nor accept anything better than what they have.
+        Those peers and the links they offer to are updated; everybody else
+        is left untouched, with the same result as updating every peer.'''
+        timer = self.profiler.timer() if self.profiler is not None else None
         # Share phase
-        for node in self.elements:
+        targets = set(self._dirty)
+        # the cached adjacency and the routing index keep the links in order,
+        # sorting them is a change too
+        reordered = False
+        for node in self._dirty:
+            links = self.elements[node].links
             self.elements[node].sort()
-            
-            for link,quality in zip(self.elements[node].links, self.elements[node].quality):
-                shared = list(zip(self.elements[node].links, self.elements[node].quality))
-                shared.remove((link, quality))
-                shared = shared[:n_share]
-                nodes, quals = zip(*self.elements[link].candidates) if len(self.elements[link].candidates)!=0 else ([], [])
-                for x in shared:
-                    if x[0] in nodes:
-                        i = nodes.index(x[0])
-                        if x[1] > quals[i]:
-                            self.elements[link].candidates[i] = x
-                    else:
-                        self.elements[link].candidates += [x]
+            reordered = reordered or links != self.elements[node].links
+            if any(self.elements[node].quality):
+                targets.update(self.elements[node].links)
+
+        for node in targets:
+            self.elements[node].candidates = self._offers(node, n_share)
+        if timer is not None:
+            timer.lap('evolve.share')
         
         # Update phase
-        for node in self.elements:
-            self.elements[node].update(self.l + 2)  
-        
+        changed = 0
+        for node in targets:
+            links = list(self.elements[node].links)
+            self.elements[node].update(self.l + 2)
+            reordered = reordered or links != self.elements[node].links
+            old, new = set(links), set(self.elements[node].links)
+
+            if old != new:
+                for link in old - new:
+                    self._inlinks[link].discard(node)
+                for link in new - old:
+                    self._inlinks[link].add(node)
+                changed += len(old ^ new)
+                if self.link_log is not None:
+                    self.link_log += [(node, link, -1) for link in old - new] + [(node, link, 1) for link in new - old]
+
+        if reordered:
+            self._snapshot = None
+            self.version += 1
+        if timer is not None:
+            timer.lap('evolve.update')
+        if self.metrics is not None:
+            self.metrics.close_epoch(self.degrees(), changed)
+        self._dirty = set()
         self.avg_distance = 0
         self.tests = 0
+
+    def degrees(self):
+        '''Out-degree of every peer, in insertion order'''
+        return np.fromiter((len(node.links) for node in self.elements.values()), np.int64, len(self.elements))
+
+    def _offers(self, node, n_share):
+        '''The candidates every peer linking `node` shares with it in the
+        share phase, merged in the same order: peers in insertion order, best
+        n_share other links of each, one entry per link keeping the first
+        position and the quality of the last better offer'''
+        candidates = []
+        index = {}
+
+        for peer in sorted(self._inlinks[node], key=self._rank.__getitem__):
+            shared = list(zip(self.elements[peer].links, self.elements[peer].quality))
+
+            for link, quality in shared:
+                if link != node:
+                    continue
+                others = shared.copy()
+                others.remove((link, quality))
+                before = {}
+                appended = []
+
+                for x in others[:n_share]:
+                    i = index.get(x[0])
+                    if i is None:
+                        appended.append(x)
+                    elif x[1] > before.setdefault(i, candidates[i][1]):
+                        candidates[i] = x
+
+                for x in appended:
+                    index.setdefault(x[0], len(candidates))
+                    candidates.append(x)
+
+        return candidates
     
     def integrity_check(self, max_depth = 5):
-        '''Every node search for itself in the network to find out 
-        if they are still connected, otherwise force links with their neighbors.'''
+        '''Every node must be able to reach itself again within max_depth
+        links to be considered connected, otherwise it forces links back to
+        itself from all its links. Returns the repaired peers in order.
 
-        for node in self.elements:
-            if self.bfs(node, node, max_depth) == None:
-                for link in self.elements[node].links:
-                    self.elements[link].links.append(node)
-                    self.elements[link].quality.append(0)
+        Instead of one search per peer, the peers on a short enough cycle are
+        found for all the peers at once, and the peers that cannot be on any
+        cycle by trimming the graph. Only the peers left, about to be
+        repaired, are searched (for the first node of level max_depth+1 that
+        the search also accepts). Nothing touches quality or avg_distance.'''
+        timer = self.profiler.timer() if self.profiler is not None else None
+        peers, offsets, neighbors = self._adjacency()
+        passed = short_cycles(offsets, neighbors, peers, min(max_depth, 3))
+        maybe = on_cycle(offsets, neighbors, peers)
+        if max_depth > 3:
+            passed |= cycles_within(offsets, neighbors, peers[maybe[peers] & ~passed[peers]], max_depth)
+        in_degree = np.bincount(neighbors, minlength=offsets.size - 1)
+        repaired = []
+        if timer is not None:
+            timer.lap('integrity_check.cycles')
+
+        for node in peers.tolist():
+            if passed[node]:
+                continue
+            # Repairs only add links, and only towards the repaired peer, so
+            # they can make other peers pass but never give them a first link in
+            if (maybe[node] or (len(repaired) != 0 and in_degree[node] != 0)) and self.search(node, node, max_depth) is not None:
+                continue
+            in_degree[node] += self._force_links(node)
+            repaired.append(node)
+        if timer is not None:
+            timer.lap('integrity_check.repair')
+
+        if self.metrics is not None:
+            self.metrics.repaired(len(repaired))
+        return repaired
+
+    def _force_links(self, node):
+        '''Every link of node links it back, returns how many links were added'''
+        for link in self.elements[node].links:
+            self.elements[link].add_link(node)
+            if self.link_log is not None and link not in self._inlinks[node]:
+                self.link_log.append((link, node, 1))
+            self._inlinks[node].add(link)
+            self._dirty.add(link)
+        self._snapshot = None
+        self.version += 1
+        return len(self.elements[node].links)
+
+    def join(self):
+        '''Adds a peer linked as init_graph links them: its first two links,
+        standing for its pred and succ on the ring, link it back, and l more
+        go to random peers. Returns its id, the id of a peer that left if
+        any is free.'''
+        node = self._free.pop() if self._free else self._next_id
+        row = self._random_peers(self.l + 2)
+        self._add_peers([node], [row])
+        for link in row[:2]:
+            self.elements[link].add_link(node)
+            self._inlinks[node].add(link)
+            self._dirty.add(link)
+        self._dirty.add(node)
+        self._snapshot = None
+        if self.link_log is not None:
+            self.link_log += [(node, link, 1) for link in row] + [(link, node, 1) for link in row[:2]]
+        return node
+
+    def leave(self, node):
+        '''Removes the peer and every link to it: the peers that linked it
+        are left with one link less, to be repaired by integrity_check if
+        that disconnects them'''
+        links = self.elements.pop(node).links
+        # evolve can leave a peer linking itself
+        linked_by = sorted(self._inlinks.pop(node) - {node}, key=self._rank.__getitem__)
+        for peer in linked_by:
+            self.elements[peer].remove_link(node)
+            self._dirty.add(peer)
+        for link in set(links):
+            if link in self._inlinks:
+                self._inlinks[link].discard(node)
+
+        del self._rank[node]
+        self._dirty.discard(node)
+        self._free.append(node)
+        self._snapshot = None
+        self.version += 1
+        if self.link_log is not None:
+            self.link_log += [(node, link, -1) for link in dict.fromkeys(links)] + [(peer, node, -1) for peer in linked_by]
+
+    def _random_peers(self, n):
+        '''n distinct random peers, all of them if there are fewer'''
+        n = min(n, len(self.elements))
+        chosen = {}
+        while len(chosen) < n:
+            for node in np.random.randint(0, self._next_id, 2 * (n - len(chosen))).tolist():
+                if node in self.elements:
+                    chosen.setdefault(node)
+                    if len(chosen) == n:
+                        break
+        return list(chosen)
 
     def draw(self, start, max_depth):
         '''Used for debugging purposes'''
@@ -231,6 +827,388 @@ class Network:
         print(string)
         
 
+class _CSRElements(Mapping):
+    '''Read-only `elements` view of a CSRNetwork: every access builds a
+    detached Node from the arrays, mutating it has no effect on the network'''
+
+    def __init__(self, net) -> None:
+        self.net = net
+
+    def __repr__(self) -> str:
+        return str(dict(self.items()))
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return self.net.node(node)
+
+    def __contains__(self, node) -> bool:
+        return 0 <= node < self.net._present.size and self.net._present[node]
+
+    def __iter__(self):
+        return iter(self.net.order.tolist())
+
+    def __len__(self) -> int:
+        return self.net.order.size
+
+
+class CSRNetwork(Network):
+    '''Same simulation as Network, but adjacency, link quality and candidate
+    buffers are stored in contiguous NumPy arrays, CSR style: the links of
+    peer `id` are `neighbors[offsets[id]:offsets[id+1]]` and their quality is
+    the same slice of `quality`. `order` keeps the peers in insertion order,
+    which is the order Network iterates its `elements` dict.'''
+
+    def __init__(self, v = 256, l = 8, engine = 'csr'):
+        self.l = l
+        self.avg_distance = 0
+        self.tests = 0
+        self.init_graph(v, l)
+
+    @classmethod
+    def from_network(cls, net):
+        '''Copies the links and quality of a dict based Network'''
+        new = super().__new__(cls)
+        new.l = net.l
+        new.avg_distance = net.avg_distance
+        new.tests = net.tests
+        new._pack([(node, net.elements[node].links, net.elements[node].quality) for node in net.elements], net._next_id)
+        new._free = list(net._free)
+        return new
+
+    @property
+    def elements(self):
+        return _CSRElements(self)
+
+    @property
+    def vertices(self):
+        return self.order.tolist()
+
+    @property
+    def _next_id(self):
+        return self.offsets.size - 1
+
+    @property
+    def edges(self):
+        owner = np.repeat(np.arange(self.offsets.size - 1), np.diff(self.offsets))
+        low = np.minimum(owner, self.neighbors).tolist()
+        high = np.maximum(owner, self.neighbors).tolist()
+        return set(zip(low, high))
+
+    @property
+    def unilinks(self):
+        '''Used for debugging'''
+        owner = np.repeat(np.arange(self.offsets.size - 1), np.diff(self.offsets))
+        return sorted(zip(owner.tolist(), self.neighbors.tolist()))
+
+    def save(self, path):
+        save_arrays(path, self._meta('csr'), self._arrays())
+
+    def _meta(self, engine):
+        return {'format': 'nsp2p.Network', 'engine': engine, 'l': self.l,
+                'avg_distance': self.avg_distance, 'tests': self.tests}
+
+    def _arrays(self):
+        return {'order': self.order, 'offsets': self.offsets, 'neighbors': self.neighbors, 'quality': self.quality}
+
+    def _unpack(self, order, offsets, neighbors, quality, dirty = None):
+        self._set_arrays(order, offsets, neighbors, quality)
+
+    def node(self, id):
+        '''Detached Node copy of the row of `id`'''
+        start, stop = self.offsets[id], self.offsets[id+1]
+        node = Node(self.neighbors[start:stop].tolist())
+        node.quality = self.quality[start:stop].tolist()
+        return node
+
+    def init_graph(self, v, l):
+        values, links = ring_graph(v, l)
+        rows = np.empty(links.shape, dtype=np.int64)
+        rows[values] = links
+        self._set_arrays(values.astype(np.int64), np.arange(v + 1, dtype=np.int64) * (l + 2), rows.ravel())
+
+    def _pack(self, rows, size = None):
+        '''Builds the arrays from (node, links, quality) rows given in insertion
+        order, with `size` rows if given, enough for the largest node if not'''
+        order = np.array([int(node) for node, _, _ in rows], dtype=np.int64)
+        if size is None:
+            size = int(order.max()) + 1 if order.size != 0 else 0
+        degree = np.zeros(size, dtype=np.int64)
+        degree[order] = [len(links) for _, links, _ in rows]
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(degree, out=offsets[1:])
+        neighbors = np.empty(offsets[-1], dtype=np.int64)
+        quality = np.zeros(offsets[-1], dtype=np.int64)
+
+        for node, links, qualities in rows:
+            neighbors[offsets[node]:offsets[node+1]] = links
+            if qualities is not None:
+                quality[offsets[node]:offsets[node+1]] = qualities
+
+        self._set_arrays(order, offsets, neighbors, quality)
+
+    def _set_arrays(self, order, offsets, neighbors, quality = None):
+        self.order = order
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.quality = np.zeros(neighbors.size, dtype=np.int64) if quality is None else quality
+        self._present = np.zeros(offsets.size - 1, dtype=bool)
+        self._present[order] = True
+        self._free = np.flatnonzero(~self._present).tolist()    # rows of no peer, reused first
+        self._reset_candidates()
+        self.version += 1
+
+    def _reset_candidates(self):
+        size = self.offsets.size - 1
+        self.cand_offsets = np.zeros(size + 1, dtype=np.int64)
+        self.cand_links = np.empty(0, dtype=np.int64)
+        self.cand_quality = np.empty(0, dtype=np.int64)
+
+    def _adjacency(self):
+        return self.order, self.offsets, self.neighbors
+
+    def _owners(self):
+        '''Row of every slot of `neighbors`'''
+        return np.repeat(np.arange(self.offsets.size - 1), np.diff(self.offsets))
+
+    def search(self, start, searched, max_depth = 4):
+        '''Level by level version of Network.search: same visiting order, same
+        fathers and same depth bound (the first node of level max_depth+1
+        is still checked, as the queue based search does)'''
+        if self.routes is not None:
+            return self.routes.search(self, start, searched, max_depth)
+        visited = np.empty(0, dtype=np.int64)
+        levels = []
+        frontier = np.array([start], dtype=np.int64)
+        depth = 0
+
+        while depth <= max_depth:
+            index, counts = gather(self.offsets, frontier)
+            links = self.neighbors[index]
+            _, first = np.unique(links, return_index=True)
+            first.sort()
+            first = first[~contains(visited, links[first])]
+            if first.size == 0:
+                return None
+
+            fathers = np.repeat(frontier, counts)[first]
+            frontier = links[first]
+            found = np.sort(frontier)
+            visited = np.insert(visited, np.searchsorted(visited, found), found)
+            levels.append((frontier, fathers))
+            depth += 1
+
+            if (frontier[0] == searched) if depth > max_depth else (frontier == searched).any():
+                break
+        else:
+            return None
+
+        path = [int(searched)]
+        for frontier, fathers in reversed(levels):
+            path.insert(0, int(fathers[np.flatnonzero(frontier == path[0])[0]]))
+        return path
+
+    def quality_update(self, path):
+        self._quality_update_batch([path])
+        return path
+
+    def _quality_update_batch(self, paths):
+        if len(paths) == 0:
+            return
+        pairs = np.array([pair for path in paths for pair in zip(path[1:-1], path[2:])], dtype=np.int64).reshape(-1, 2)
+
+        # slots sorted by (row, link), first occurrence of a link first
+        size = self.offsets.size - 1
+        keys = self._owners() * size + self.neighbors
+        slots = np.argsort(keys, kind='stable')
+        found = np.searchsorted(keys[slots], pairs[:, 0] * size + pairs[:, 1])
+        np.add.at(self.quality, slots[found], 1)
+
+        depths = sum(len(path) - 1 for path in paths)
+        self.avg_distance = (self.avg_distance * self.tests + depths) / (self.tests + len(paths))
+        self.tests += len(paths)
+
+    def evolve(self, n_share = 3, n = 3):
+        '''Vectorized Network.evolve: the candidates offered to every peer are
+        merged by id keeping the best quality and the position of the first
+        offer, then each row swaps its worst links exactly as Node.update does'''
+        size = self.offsets.size - 1
+        degree = np.diff(self.offsets)
+        owner = self._owners()
+        position = np.arange(owner.size) - self.offsets[owner]
+        timer = self.profiler.timer() if self.profiler is not None else None
+
+        # Share phase: rows sorted by decreasing quality, ties keep their order
+        perm = np.lexsort((position, -self.quality, owner))
+        self.neighbors, self.quality = self.neighbors[perm], self.quality[perm]
+
+        rank = np.zeros(size, dtype=np.int64)
+        rank[self.order] = np.arange(self.order.size)
+        width = int(degree.max()) if size != 0 else 0
+        targets, offered, quals, seqs = [], [], [], []
+
+        # shared.remove((link, quality)) drops the first equal pair of the row
+        same = np.lexsort((position, self.quality, self.neighbors, owner))
+        new_pair = np.ones(same.size, dtype=bool)
+        new_pair[1:] = (np.diff(owner[same]) != 0) | (np.diff(self.neighbors[same]) != 0) | (np.diff(self.quality[same]) != 0)
+        removed = np.empty_like(position)
+        removed[same] = position[same][np.maximum.accumulate(np.where(new_pair, np.arange(same.size), 0))]
+
+        for t in range(n_share):
+            # every link receives the best n_share other links of the row
+            shared = t + (t >= removed)
+            valid = shared < degree[owner]
+            source = (self.offsets[owner] + shared)[valid]
+            targets.append(self.neighbors[valid])
+            offered.append(self.neighbors[source])
+            quals.append(self.quality[source])
+            seqs.append((rank[owner[valid]] * width + position[valid]) * n_share + t)
+
+        self._merge_candidates(np.concatenate(targets), np.concatenate(offered),
+                               np.concatenate(quals), np.concatenate(seqs))
+        if timer is not None:
+            timer.lap('evolve.share')
+
+        # Update phase
+        watched = self.metrics is not None or self.link_log is not None
+        before = self._link_keys() if watched else None
+        self._update(n)
+        self._reset_candidates()
+        if timer is not None:
+            timer.lap('evolve.update')
+
+        if watched:
+            after = self._link_keys()
+            added, removed = after[~contains(before, after)], before[~contains(after, before)]
+            if self.link_log is not None:
+                for keys, sign in ((removed, -1), (added, 1)):
+                    rows, links = np.divmod(keys, size) if size != 0 else (keys, keys)
+                    self.link_log += [(row, link, sign) for row, link in zip(rows.tolist(), links.tolist())]
+            if self.metrics is not None:
+                self.metrics.close_epoch(self.degrees(), added.size + removed.size)
+
+        self.avg_distance = 0
+        self.tests = 0
+
+    def degrees(self):
+        return np.diff(self.offsets)[self.order]
+
+    def _link_keys(self):
+        '''Sorted distinct (row, link) pairs as row * size + link'''
+        return distinct(self._owners() * (self.offsets.size - 1) + self.neighbors)
+
+    def _merge_candidates(self, targets, offered, quals, seqs):
+        '''Keeps one candidate per (target, link) with its best quality and
+        first offer, sorted like Node.update sorts them'''
+        size = self.offsets.size - 1
+        pair = targets * size + offered
+        order = np.argsort(pair, kind='stable')
+        pair = pair[order]
+        starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]]) if pair.size != 0 else np.empty(0, dtype=np.int64)
+        best = np.maximum.reduceat(quals[order], starts) if starts.size != 0 else quals
+        first = np.minimum.reduceat(seqs[order], starts) if starts.size != 0 else seqs
+        target, link = np.divmod(pair[starts], size) if size != 0 else (pair, pair)
+
+        order = np.lexsort((first, -best, target))
+        self.cand_offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(target, minlength=size), out=self.cand_offsets[1:])
+        self.cand_links, self.cand_quality = link[order], best[order]
+
+    def _update(self, n):
+        '''Node.update for every row at once'''
+        size = self.offsets.size - 1
+        degree = np.diff(self.offsets)
+        owner = self._owners()
+        position = np.arange(owner.size) - self.offsets[owner]
+
+        # the n best candidates against the n worst links (first index on ties)
+        cand_owner = np.repeat(np.arange(size), np.diff(self.cand_offsets))
+        cand_rank = np.arange(cand_owner.size) - self.cand_offsets[cand_owner]
+        top = cand_rank < n
+        cand_q = np.full((size, n), -1, dtype=np.int64)
+        cand_l = np.zeros((size, n), dtype=np.int64)
+        cand_q[cand_owner[top], cand_rank[top]] = self.cand_quality[top]
+        cand_l[cand_owner[top], cand_rank[top]] = self.cand_links[top]
+
+        worst = np.lexsort((position, self.quality, owner))
+        worst_rank = np.arange(worst.size) - self.offsets[owner[worst]]
+        low = worst_rank < n
+        worst_q = np.full((size, n), np.iinfo(np.int64).max, dtype=np.int64)
+        worst_slot = np.zeros((size, n), dtype=np.int64)
+        worst_q[owner[worst[low]], worst_rank[low]] = self.quality[worst[low]]
+        worst_slot[owner[worst[low]], worst_rank[low]] = worst[low]
+
+        replace = np.logical_and.accumulate(cand_q > worst_q, axis=1)
+        self.neighbors[worst_slot[replace]] = cand_l[replace]
+        self.quality[worst_slot[replace]] = cand_q[replace]
+
+        # sort and keep the best l+2 links of each row
+        perm = np.lexsort((position, -self.quality, owner))
+        keep = position < self.l + 2
+        self.neighbors = self.neighbors[perm][keep]
+        self.quality = np.zeros(self.neighbors.size, dtype=np.int64)
+        self.offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.minimum(degree, self.l + 2), out=self.offsets[1:])
+        self.version += 1
+
+    def join(self):
+        '''Network.join on the arrays: the row of a free id, or a new last
+        row, gets the links, then its pred and succ links get it appended'''
+        node = self._free.pop() if self._free else self._next_id
+        row = self._random_peers(self.l + 2)
+        if node == self._next_id:
+            self.offsets = np.append(self.offsets, self.offsets[-1])
+            self._present = np.append(self._present, False)
+        at = self.offsets[node]
+        self.neighbors = np.insert(self.neighbors, at, row)
+        self.quality = np.insert(self.quality, at, [0] * len(row))
+        self.offsets[node+1:] += len(row)
+        self.order = np.append(self.order, node)
+        self._present[node] = True
+        if self.link_log is not None:
+            self.link_log += [(node, link, 1) for link in row]
+        self._append_links(row[:2], node)
+        return node
+
+    def leave(self, node):
+        '''Network.leave on the arrays: the row of node and every slot linking
+        it are dropped, the row stays empty until a join reuses the id'''
+        linking = np.flatnonzero(self.neighbors == node)
+        owner = np.searchsorted(self.offsets, linking, 'right') - 1
+        start, stop = self.offsets[node], self.offsets[node+1]
+        if self.link_log is not None:
+            links = self.neighbors[start:stop].tolist()
+            linked_by = self.order[contains(distinct(owner[owner != node]), self.order)].tolist()
+            self.link_log += [(node, link, -1) for link in dict.fromkeys(links)] + [(peer, node, -1) for peer in linked_by]
+
+        gone = np.union1d(linking, np.arange(start, stop))
+        self.neighbors, self.quality = np.delete(self.neighbors, gone), np.delete(self.quality, gone)
+        counts = np.bincount(np.searchsorted(self.offsets, gone, 'right') - 1, minlength=self.offsets.size - 1)
+        self.offsets[1:] -= np.cumsum(counts)
+        self.order = self.order[self.order != node]
+        self._present[node] = False
+        self._free.append(node)
+        self._reset_candidates()
+        self.version += 1
+
+    def _force_links(self, node):
+        self._append_links(self.neighbors[self.offsets[node]:self.offsets[node+1]], node)
+        return int(self.offsets[node+1] - self.offsets[node])
+
+    def _append_links(self, nodes, link):
+        '''Appends `link` with quality 0 at the end of the rows of `nodes`'''
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if self.link_log is not None:
+            self.link_log += [(node, int(link), 1) for node in dict.fromkeys(nodes.tolist())
+                              if not (self.neighbors[self.offsets[node]:self.offsets[node+1]] == link).any()]
+        at = self.offsets[nodes + 1]
+        self.neighbors = np.insert(self.neighbors, at, link)
+        self.quality = np.insert(self.quality, at, 0)
+        self.offsets[1:] += np.cumsum(np.bincount(nodes, minlength=self.offsets.size - 1))
+        self._reset_candidates()
+        self.version += 1
+
+
 if __name__ == '__main__':
     net = Network(20, 2)
     iterations = 1000
@@ -121,10 +121,10 @@ class Graph:
         return edges
 
     def init_graph(self, v, l):
-        ids = np.arange(v, dtype=np.uint8)
+        ids = np.arange(v, dtype=np.min_scalar_type(max(v - 1, 0)))
         values = np.random.choice(ids, size=v, replace=False)
         free_nodes = values.copy()
-        for i in ids:
+        for i in range(v):
             node = values[i]
             pred_succ = [values[(i-1) % v], values[(i+1) % v]]
             free_nodes = np.delete(free_nodes, 0) if node in free_nodes else free_nodes
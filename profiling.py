@@ -0,0 +1,154 @@
+'''Profiling of the hot methods of nsp2p.Network and dht.Ring, switched on and
+off at runtime: call counts, times, sampled per-call durations and the
+phases of evolve and integrity_check'''
+from collections import deque
+import functools
+import json
+from time import perf_counter
+import numpy as np
+import dht
+import nsp2p
+
+# methods wrapped by a Profiler, by the class defining them
+HOT = {
+    nsp2p.Network: ('simulate', 'bfs', 'search', 'quality_update', 'bfs_batch', 'search_many', 'evolve', '_offers',
+                    'integrity_check', '_force_links', 'join', 'leave', '_adjacency'),
+    nsp2p.CSRNetwork: ('search', 'quality_update', '_quality_update_batch', 'evolve', '_merge_candidates', '_update',
+                       '_append_links', 'join', 'leave'),
+    dht.Ring: ('linear_search_on_ring', 'circular_search_on_ring', 'linear_search_path', 'circular_search_path',
+               'linear_insert_on_ring', 'circular_insert_on_ring', '_fill_FT', '_iteratively_fix_FTs', 'remove_from_ring'),
+}
+
+class Stat:
+    '''Calls and seconds of one method or phase, with the sampled durations'''
+    __slots__ = ('calls', 'total', 'max', 'samples')
+
+    def __init__(self, samples) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=samples)
+
+
+class PhaseTimer:
+    '''Splits a call into phases: lap(name) charges the time since the last
+    lap, or since the timer was made, to the phase `name`'''
+
+    def __init__(self, profiler) -> None:
+        self.profiler = profiler
+        self.last = perf_counter()
+
+    def lap(self, name):
+        now = perf_counter()
+        self.profiler.add(name, now - self.last)
+        self.last = now
+
+
+class Profiler:
+    '''profiler.enable() wraps the HOT methods (or `methods`, a class -> names
+    dict) and times the phases of evolve and integrity_check; disable()
+    puts the original methods back, so nothing is left to pay when off.
+    Also a context manager. Method times are inclusive: bfs counts the
+    search it calls.
+
+    With `sample_every` = n the duration of every n-th call is kept, the
+    last `samples` of them per method, for the percentiles of summary().'''
+
+    def __init__(self, sample_every = None, samples = 4096, methods = None) -> None:
+        self.sample_every = sample_every
+        self.samples = samples
+        self.methods = HOT if methods is None else methods
+        self.stats = {}
+        self._originals = []
+
+    @property
+    def enabled(self):
+        return nsp2p.Network.profiler is self
+
+    def enable(self):
+        if self.enabled:
+            return
+        if nsp2p.Network.profiler is not None:
+            raise ValueError('another Profiler is enabled')
+        for cls, names in self.methods.items():
+            for name in names:
+                original = cls.__dict__[name]
+                self._originals.append((cls, name, original))
+                setattr(cls, name, self._wrap('{}.{}'.format(cls.__name__, name), original))
+        nsp2p.Network.profiler = self
+
+    def disable(self):
+        for cls, name, original in reversed(self._originals):
+            setattr(cls, name, original)
+        self._originals = []
+        if self.enabled:
+            nsp2p.Network.profiler = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def _wrap(self, name, method):
+        @functools.wraps(method)
+        def profiled(*args, **kwargs):
+            began = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(name, perf_counter() - began)
+        return profiled
+
+    def timer(self):
+        return PhaseTimer(self)
+
+    def add(self, name, seconds):
+        '''Counts one call of `name` lasting `seconds`'''
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = Stat(self.samples)
+        stat.calls += 1
+        stat.total += seconds
+        stat.max = max(stat.max, seconds)
+        if self.sample_every is not None and stat.calls % self.sample_every == 0:
+            stat.samples.append(seconds)
+
+    def reset(self):
+        self.stats = {}
+
+    def summary(self):
+        '''name -> calls, seconds (total, mean, max) and, when sampled, the
+        p50/p90/p99 of the sampled calls, slowest in total first'''
+        summary = {}
+        for name, stat in sorted(self.stats.items(), key=lambda item: -item[1].total):
+            summary[name] = {'calls': stat.calls, 'total': stat.total, 'mean': stat.total / stat.calls, 'max': stat.max}
+            if stat.samples:
+                p50, p90, p99 = np.percentile(np.array(stat.samples), [50, 90, 99]).tolist()
+                summary[name].update(p50=p50, p90=p90, p99=p99)
+        return summary
+
+    def table(self):
+        lines = ['{:<40} {:>10} {:>12} {:>12} {:>12} {:>12}'.format('name', 'calls', 'total s', 'mean us', 'max us', 'p99 us')]
+        for name, stat in self.summary().items():
+            p99 = '{:>12.1f}'.format(stat['p99'] * 1e6) if 'p99' in stat else '{:>12}'.format('-')
+            lines.append('{:<40} {:>10} {:>12.4f} {:>12.1f} {:>12.1f} {}'.format(
+                name, stat['calls'], stat['total'], stat['mean'] * 1e6, stat['max'] * 1e6, p99))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        '''Writes the summary as JSON, e.g. next to a MetricsStream sink'''
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=1)
+
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    net = nsp2p.Network(2048, 8)
+    with Profiler(sample_every=10) as profiler:
+        for _ in range(3):
+            net.simulate(1000)
+            net.evolve()
+            net.integrity_check()
+    print(profiler.table())
@@ -0,0 +1,121 @@
+'''Routing index for repeated nsp2p.Network searches: the BFS tree of a source
+is built once and answers every later search from it by walking back the
+fathers, until the links change'''
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+from nsp2p import gather
+
+class RoutingIndex:
+    '''Attach with net.routes = RoutingIndex(); Network.search then answers
+    from the index, with the same paths.
+
+    A tree holds the father of every peer the search from its source accepts
+    within max_depth, so a lookup costs the length of the path. Trees are
+    built lazily, one per (source, max_depth), and the least recently used
+    are evicted to keep at most `size` entries in all. Every tree is dropped
+    as soon as net.version says the links changed (evolve, integrity_check);
+    quality updates leave them valid.'''
+
+    def __init__(self, size = 2**20) -> None:
+        self.size = size
+        self.trees = OrderedDict()
+        self.entries = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.build_time = 0.0
+        self.built_entries = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def search(self, net, start, searched, max_depth = 4):
+        '''Same result as net.search without the index'''
+        father = self.tree(net, start, max_depth)
+        if searched not in father:
+            return None
+
+        path = [searched]
+        node = father[searched]
+        while node != start:
+            path.append(node)
+            node = father[node]
+        path.append(start)
+        path.reverse()
+        return path
+
+    def tree(self, net, start, max_depth = 4):
+        '''peer -> father of every peer the search from start accepts'''
+        if self.version != net.version:
+            if self.trees:
+                self.invalidations += 1
+            self.clear()
+            self.version = net.version
+
+        key = (start, max_depth)
+        father = self.trees.get(key)
+        if father is not None:
+            self.trees.move_to_end(key)
+            self.hits += 1
+            return father
+
+        self.misses += 1
+        began = perf_counter()
+        father = self._build(net, start, max_depth)
+        self.build_time += perf_counter() - began
+        self.built_entries += len(father)
+
+        if len(father) <= self.size:
+            self.trees[key] = father
+            self.entries += len(father)
+            while self.entries > self.size:
+                _, dropped = self.trees.popitem(last=False)
+                self.entries -= len(dropped)
+                self.evictions += 1
+        return father
+
+    def _build(self, net, start, max_depth):
+        '''The fathers Network.search assigns, a level at a time: the start is
+        not visited until a link leads back to it, and the first peer of
+        level max_depth+1 is accepted too'''
+        _, offsets, neighbors = net._adjacency()
+        seen = np.zeros(offsets.size - 1, dtype=bool)
+        frontier = np.array([start], dtype=np.int64)
+        nodes, fathers = [], []
+
+        for depth in range(1, max_depth + 2):
+            index, counts = gather(offsets, frontier)
+            links = neighbors[index]
+            new = np.flatnonzero(~seen[links])
+            if depth > max_depth:
+                new = new[:1]
+            elif new.size != 0:
+                # first occurrence of every link, in visiting order
+                order = np.argsort(links[new], kind='stable')
+                ordered = links[new][order]
+                new = np.sort(new[order][np.r_[True, ordered[1:] != ordered[:-1]]])
+            if new.size == 0:
+                break
+
+            fathers.append(np.repeat(frontier, counts)[new])
+            frontier = links[new]
+            nodes.append(frontier)
+            seen[frontier] = True
+
+        if not nodes:
+            return {}
+        return dict(zip(np.concatenate(nodes).tolist(), np.concatenate(fathers).tolist()))
+
+    def clear(self):
+        self.trees.clear()
+        self.entries = 0
+
+    def summary(self):
+        return {'trees': len(self.trees), 'entries': self.entries, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'evictions': self.evictions, 'invalidations': self.invalidations,
+                'build_time': self.build_time, 'built_entries': self.built_entries}
@@ -0,0 +1,324 @@
+'''Message passing runtime for nsp2p.Network on asyncio: every peer is a task
+reading its inbox, a search floods TTL limited query messages along the
+links and the answer comes back as a reply along the path it took, which
+is what updates the links' quality'''
+import asyncio
+from collections import OrderedDict, deque
+from functools import partial
+import math
+import random
+import numpy as np
+
+QUERY, REPLY = 0, 1
+
+MODES = ('visited', 'flood', 'cache', 'walk')
+
+class Query:
+    '''One search in flight. `seen` holds the peers that already got it: it
+    counts the duplicates in every mode, and is the duplicate filter itself
+    in 'visited' mode. The start is in it from the beginning unless it is
+    the peer searched, which the query then finds coming back like bfs.'''
+
+    def __init__(self, id, start, searched, future, started) -> None:
+        self.id = id
+        self.start = start
+        self.searched = searched
+        self.future = future
+        self.started = started
+        self.seen = set() if start == searched else {start}
+        self.in_flight = 0
+        self.messages = 0
+        self.duplicates = 0
+
+
+class Inbox:
+    '''The messages waiting for one peer: an asyncio.Queue cut down to its
+    only reader, a few hundred bytes instead of some kilobytes per peer'''
+    __slots__ = ('items', 'waiter')
+
+    def __init__(self) -> None:
+        self.items = deque()
+        self.waiter = None
+
+    def put_nowait(self, item):
+        self.items.append(item)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self):
+        while not self.items:
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+            self.waiter = None
+        return self.items.popleft()
+
+
+class LocalTransport:
+    '''Carries messages between the peers of this process. `latency` is the
+    delay of every message in seconds, or a function returning one per
+    message (see jitter). Delayed messages are delivered together every
+    `resolution` seconds, one timer per tick instead of one per message.'''
+
+    def __init__(self, latency = 0.0, resolution = 0.001) -> None:
+        self.latency = latency
+        self.resolution = resolution
+        self.inboxes = {}
+        self.sent = 0
+        self._due = {}
+
+    def send(self, query, node, message):
+        query.in_flight += 1
+        query.messages += 1
+        self.sent += 1
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay <= 0:
+            self.inboxes[node].put_nowait(message)
+            return
+
+        loop = asyncio.get_running_loop()
+        tick = math.ceil((loop.time() + delay) / self.resolution)
+        due = self._due.get(tick)
+        if due is None:
+            due = self._due[tick] = []
+            loop.call_at(tick * self.resolution, self._deliver, tick)
+        due.append((node, message))
+
+    def _deliver(self, tick):
+        for node, message in self._due.pop(tick):
+            self.inboxes[node].put_nowait(message)
+
+def jitter(low, high, seed = None):
+    '''Latency uniformly drawn in [low, high) seconds, seeded'''
+    return partial(random.Random(seed).uniform, low, high)
+
+
+def loop_erased(path):
+    '''path without the loops it makes, a walk back to a peer it already
+    passed dropping everything in between'''
+    erased, position = [], {}
+    for node in path:
+        if node in position:
+            for dropped in erased[position[node] + 1:]:
+                del position[dropped]
+            del erased[position[node] + 1:]
+        else:
+            position[node] = len(erased)
+            erased.append(node)
+    return erased
+
+
+class Runtime:
+    '''Runs the peers of `net` as asyncio tasks, to be used as
+    `async with Runtime(net) as runtime: await runtime.search(a, b)`.
+
+    A query travels at most max_depth links from the start. How the peers
+    forward it is the mode:
+        'visited': flooding where no peer forwards a query twice, the cost
+                   model of bfs (perfect duplicate suppression). One query
+                   at a time at zero latency, it finds the paths of
+                   Network.search but for the first peer of level
+                   max_depth+1, which that search accepts too. With queries
+                   running concurrently, or latency, the first copy to reach
+                   a peer needn't be the one of a shortest path, so a path
+                   can come out longer or be missed.
+        'flood':   plain flooding, every copy forwarded to all the links but
+                   the one it came from
+        'cache':   flooding where every peer drops the queries it remembers,
+                   keeping the last `cache_size` it forwarded (bounded
+                   memory: cache_size entries per peer at most)
+        'walk':    `walkers` random walks from the start, one random link per
+                   step, avoiding the one they came from when they can
+    The first reply to reach the start answers it, and its loop erased path
+    is rewarded with net.quality_update as bfs does; the query ends when
+    none of its messages are left, which is when it is counted in report().'''
+
+    def __init__(self, net, transport = None, mode = 'visited', cache_size = 64, walkers = 16) -> None:
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}: {}'.format(', '.join(MODES), mode))
+        self.net = net
+        self.transport = LocalTransport() if transport is None else transport
+        self.mode = mode
+        self.cache_size = cache_size
+        self.walkers = walkers
+        self.caches = {}  # peer -> ids of the queries it remembers, in 'cache' mode
+        self.tasks = []
+        self.messages = []
+        self.duplicates = []
+        self.answer_times = []
+        self.errors = []    # exceptions raised handling a message, each failing its query
+        self.queries = 0
+        self.found = 0
+        self.active = 0
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def start(self):
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.transport.inboxes = {node: Inbox() for node in self.net.elements}
+        self.tasks = [asyncio.create_task(self._peer(node, inbox)) for node, inbox in self.transport.inboxes.items()]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def search(self, start, searched, max_depth = 4):
+        '''Path found from start to searched, or None'''
+        loop = asyncio.get_running_loop()
+        query = Query(self.queries, start, searched, loop.create_future(), loop.time())
+        self.queries += 1
+        self.active += 1
+        self._idle.clear()
+        if self.mode == 'cache':
+            self._remember(start, query)
+        links = self.net.elements[start].links
+        if max_depth > 0 and links:
+            if self.mode == 'walk':
+                links = [links[i] for i in np.random.randint(0, len(links), self.walkers).tolist()]
+            for link in links:
+                self.transport.send(query, link, (QUERY, query, [start], max_depth - 1))
+        if query.in_flight == 0:
+            self._finish(query)
+
+        path = await query.future
+        if self.net.metrics is not None:
+            self.net.metrics.lookup(path)
+        if path is not None:
+            self.net.quality_update(path)
+        return path
+
+    async def simulate(self, queries = 1000, max_depth = 4, concurrency = 1000):
+        '''Random searches like Network.simulate, at most `concurrency` at once'''
+        values = list(self.net.elements)
+        pairs = zip(np.random.choice(values, queries).tolist(), np.random.choice(values, queries).tolist())
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(start, searched):
+            async with limit:
+                return await self.search(start, searched, max_depth)
+
+        return await asyncio.gather(*(one(start, searched) for start, searched in pairs))
+
+    async def _peer(self, node, inbox):
+        while True:
+            kind, query, path, ttl = await inbox.get()
+            try:
+                self._handle(node, kind, query, path, ttl)
+            except Exception as error:
+                # the query fails instead of the peer, which keeps serving the others
+                self.errors.append(error)
+                if not query.future.done():
+                    query.future.set_exception(error)
+
+            query.in_flight -= 1
+            if query.in_flight == 0:
+                self._finish(query)
+
+    def _handle(self, node, kind, query, path, ttl):
+        if kind == QUERY:
+            duplicate = node in query.seen
+            if duplicate:
+                query.duplicates += 1
+            else:
+                query.seen.add(node)
+            if self.mode == 'visited':
+                passes = not duplicate
+            elif self.mode == 'cache':
+                passes = self._remember(node, query)
+            else:
+                passes = True
+            if passes:
+                self._forward(node, query, path + [node], ttl)
+        elif ttl != 0:
+            self.transport.send(query, path[ttl - 1], (REPLY, query, path, ttl - 1))
+        elif not query.future.done():
+            self.answer_times.append(asyncio.get_running_loop().time() - query.started)
+            self.found += 1
+            query.future.set_result(path)
+
+    def _remember(self, node, query):
+        '''False if node's cache already holds query, else adds it there'''
+        cache = self.caches.get(node)
+        if cache is None:
+            cache = self.caches[node] = OrderedDict()
+        if query.id in cache:
+            cache.move_to_end(query.id)
+            return False
+        cache[query.id] = None
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return True
+
+    def _forward(self, node, query, path, ttl):
+        '''Replies if node is the one searched, else passes the query on'''
+        if node == query.searched:
+            # the searched peer closes the path, a cycle when it is the start
+            path = loop_erased(path[:-1]) + [node]
+            self.transport.send(query, path[-2], (REPLY, query, path, len(path) - 2))
+            return
+        if ttl == 0:
+            return
+
+        links = self.net.elements[node].links
+        if self.mode == 'walk':
+            others = [link for link in links if link != path[-2]] or links
+            if others:
+                self.transport.send(query, others[np.random.randint(len(others))], (QUERY, query, path, ttl - 1))
+            return
+        for link in links:
+            if link != path[-2] or link == query.searched:
+                self.transport.send(query, link, (QUERY, query, path, ttl - 1))
+
+    async def join(self):
+        '''Waits until no query has messages left'''
+        await self._idle.wait()
+
+    def _finish(self, query):
+        self.active -= 1
+        if self.active == 0:
+            self._idle.set()
+        self.messages.append(query.messages)
+        self.duplicates.append(query.duplicates)
+        query.seen = None
+        if not query.future.done():
+            query.future.set_result(None)
+
+    def report(self):
+        '''Messages and duplicates per finished query, success rate and
+        time-to-answer percentiles (seconds) of the answered ones'''
+        times = np.array(self.answer_times)
+        percentiles = np.percentile(times, [50, 90, 99]).tolist() if times.size else [0.0] * 3
+        return {'mode': self.mode, 'queries': self.queries, 'finished': len(self.messages), 'errors': len(self.errors),
+                'success_rate': self.found / self.queries if self.queries else 0.0,
+                'messages_per_query': float(np.mean(self.messages)) if self.messages else 0.0,
+                'duplicates_per_query': float(np.mean(self.duplicates)) if self.duplicates else 0.0,
+                'answer_p50': percentiles[0], 'answer_p90': percentiles[1], 'answer_p99': percentiles[2]}
+
+def run(net, queries = 1000, max_depth = 4, latency = 0.0, concurrency = 1000, **options):
+    '''Runs `queries` random searches on net and returns the report, options
+    going to Runtime (mode, cache_size, walkers)'''
+    async def main():
+        async with Runtime(net, LocalTransport(latency), **options) as runtime:
+            await runtime.simulate(queries, max_depth, concurrency)
+            await runtime.join()
+            return runtime.report()
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    from nsp2p import Network
+    np.random.seed(0)
+    net = Network(10**4, 8)
+    print('{:<8} {:>9} {:>12} {:>12}'.format('mode', 'success', 'messages', 'duplicates'))
+    for mode, max_depth in (('visited', 3), ('flood', 3), ('cache', 3), ('walk', 64)):
+        np.random.seed(1)
+        report = run(net, queries=500, max_depth=max_depth, mode=mode)
+        print('{:<8} {:>9.3f} {:>12.1f} {:>12.1f}'.format(
+            mode, report['success_rate'], report['messages_per_query'], report['duplicates_per_query']))
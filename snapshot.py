@@ -0,0 +1,33 @@
+'''Snapshots as a directory holding one .npy file per array and a meta.json,
+so that big arrays can be memory mapped back instead of read'''
+import json
+import os
+import numpy as np
+
+def save_arrays(path, meta, arrays):
+    '''Writes `arrays` (name -> array) and the json-able `meta` dict under
+    path. Object arrays are pickled, and can't be memory mapped later.
+    meta.json is written last: a snapshot without it is incomplete.'''
+    os.makedirs(path, exist_ok=True)
+    objects = []
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if array.dtype == object:
+            objects.append(name)
+        np.save(os.path.join(path, name + '.npy'), array, allow_pickle=array.dtype == object)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(dict(meta, arrays=list(arrays), objects=objects), file)
+
+def load_arrays(path, mmap_mode = None):
+    '''(meta, arrays) of a snapshot saved by save_arrays. mmap_mode is given to
+    np.load: 'r' maps read only, 'c' copy on write, None reads everything.'''
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+
+    arrays = {}
+    for name in meta['arrays']:
+        pickled = name in meta['objects']
+        arrays[name] = np.load(os.path.join(path, name + '.npy'), allow_pickle=pickled,
+                               mmap_mode=None if pickled else mmap_mode)
+    return meta, arrays
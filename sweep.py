@@ -0,0 +1,47 @@
+'''Parameter sweeps of nsp2p.Network spread over a process pool'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import numpy as np
+from nsp2p import Network
+
+def run(params):
+    '''One simulation run, seeded by params['seed']: build the network, then
+    simulate, evolve and integrity_check it for params['epochs'] epochs.
+    Returns params with one record per epoch.'''
+    np.random.seed(params['seed'])
+    net = Network(params['v'], params['l'], params.get('engine', 'dict'))
+    epochs = []
+
+    for epoch in range(params['epochs']):
+        net.simulate(params['iterations'], params['max_depth'], batch_size=params.get('batch_size'))
+        record = {'epoch': epoch, 'avg_distance': net.avg_distance, 'tests': net.tests}
+        net.evolve(params['n_share'])
+        net.integrity_check()
+        start = net.vertices[0]
+        record['edges'] = len(net.edges)
+        record['connected'] = net.reach(start) / len(net.vertices)
+        epochs.append(record)
+
+    return dict(params, epochs=epochs)
+
+def grid(v = (256,), l = (8,), max_depth = (4,), n_share = (3,), repeats = 1, seed = 0, **fixed):
+    '''Every combination of the given values, `repeats` times each, with an
+    independent seed per run derived from `seed`'''
+    combos = list(product(v, l, max_depth, n_share)) * repeats
+    seeds = np.random.SeedSequence(seed).generate_state(len(combos))
+    defaults = {'epochs': 10, 'iterations': 1000}
+    return [dict(defaults, v=c[0], l=c[1], max_depth=c[2], n_share=c[3], seed=int(s), **fixed) for c, s in zip(combos, seeds)]
+
+def sweep(runs, workers = None):
+    '''Runs every params dict of `runs` on a pool of `workers` processes
+    (one per CPU by default) and yields the results as they finish'''
+    with ProcessPoolExecutor(workers) as pool:
+        for future in as_completed([pool.submit(run, params) for params in runs]):
+            yield future.result()
+
+
+if __name__ == '__main__':
+    for result in sweep(grid(v=(256, 1024), l=(4, 8), repeats=2, epochs=5)):
+        last = result['epochs'][-1]
+        print('v={v} l={l} max_depth={max_depth} n_share={n_share} seed={seed}'.format(**result),
+              'avg_distance={:.3f} edges={} connected={:.2f}'.format(last['avg_distance'], last['edges'], last['connected']))
@@ -0,0 +1,33 @@
+import numpy as np
+import churn
+from nsp2p import Network
+
+def churned(engine):
+    np.random.seed(3)
+    net = Network(200, 4, engine)
+    net.link_log = []
+    records = churn.run(net, churn.Churn(rate=20, mean_session=10, seed=1), epochs=4, iterations=200)
+    for record in records:
+        del record['events_per_s']
+    return net, records
+
+def test_csr_churn_matches_dict():
+    net, records = churned('dict')
+    csr, csr_records = churned('csr')
+    assert records == csr_records
+    assert sum(record['leaves'] for record in records) > 0
+    assert list(csr.elements) == list(net.elements)
+    assert csr.unilinks == net.unilinks
+    assert sorted(csr.link_log) == sorted(net.link_log)
+
+def test_csr_leave_then_join_reuses_the_id():
+    np.random.seed(0)
+    net = Network(50, 3, 'csr')
+    version = net.version
+    net.leave(7)
+    assert 7 not in net.elements and len(net.elements) == 49
+    assert all(7 not in net.elements[node].links for node in net.elements)
+    assert net.join() == 7 and 7 in net.elements
+    assert net.join() == 50 and len(net.elements) == 51
+    assert all(7 in net.elements[link].links for link in net.elements[7].links[:2])
+    assert net.version > version
@@ -0,0 +1,79 @@
+import numpy as np
+from dht import DHT, ArrayRing, LookupCache, fingers
+
+def test_leave_on_a_ring_built_by_insert():
+    rng = np.random.default_rng(2)
+    k = 7
+    ids = rng.choice(2**k, 96, replace=False).tolist()
+    dht = DHT(k)
+    for id in ids:
+        dht.insert(id)
+
+    left = ids[::3]
+    for id in left:
+        dht.leave(id)
+    alive = sorted(set(ids) - set(left))
+
+    table = fingers(alive, k).tolist()
+    assert [dht.ring.elements[id].FT for id in alive] == table
+    assert not set(left) & {id for row in table for id in row}
+    for key in range(2**k):
+        assert dht.search(key) == alive[np.searchsorted(alive, key) % len(alive)]
+    for id in left[:5]:
+        dht.insert(id)
+
+def test_array_ring_search_without_keys():
+    ring = ArrayRing.from_ids(np.random.default_rng(0).choice(2**16, 100, replace=False), 16)
+    for keys in ([], np.empty((0, 3), dtype=np.int64)):
+        ids, hops = ring.search(keys)
+        assert ids.shape == hops.shape == np.shape(keys)
+        assert ids.dtype == hops.dtype == np.int64
+
+def test_numpy_integer_keys_route_like_ints():
+    dht = DHT.from_ids(np.random.default_rng(0).choice(2**8, 10, replace=False), 8)
+    for key in range(200):
+        dht.put(key, key)
+    assert [dht.get(np.int64(key)) for key in range(200)] == list(range(200))
+    assert dht.get_many(np.arange(200)) == list(range(200))
+
+def test_inserted_node_takes_over_its_keys():
+    rng = np.random.default_rng(0)
+    ids = rng.choice(2**8, 20, replace=False).tolist()
+    dht = DHT(8)
+    for id in ids[:10]:
+        dht.insert(id)
+    for key in range(256):
+        dht.put(key, -key)
+    for id in ids[10:]:
+        dht.insert(id)
+
+    assert [dht.get(key) for key in range(256)] == [-key for key in range(256)]
+    assert sum(len(node.resources) for node in dht.ring.elements.values()) == 256
+    dht.delete(200)
+    assert dht.get(200) is None
+
+def test_virtual_nodes_after_insert_and_leave(tmp_path):
+    dht = DHT.from_peers(['a', 'b', 'c'], 16, 4)
+    free = next(id for id in range(2**16) if id not in dht.ring.elements)
+    dht.insert(free)
+    dht.insert(free + 1 if free + 1 not in dht.ring.elements else free + 2, owner=1)
+    dht.leave(next(iter(dht.owners)))
+    for key in range(100):
+        dht.put(key, key)
+
+    load = dht.load()
+    assert load['share'].size == 4 and load['items'].sum() == 100
+    assert load['share'].sum() == 1.0
+    dht.save(tmp_path / 'dht')
+    copy = DHT.from_snapshot(tmp_path / 'dht')
+    assert copy.owners == dht.owners
+    assert np.array_equal(copy.load()['share'], load['share'])
+
+def test_lookup_cache_size():
+    dht = DHT.from_ids(np.random.default_rng(0).choice(2**12, 50, replace=False), 12)
+    alive = sorted(dht.ring.elements)
+    for size in (0, 1, 3):
+        dht.ring.cache = LookupCache(12, size)
+        for key in list(range(0, 2**12, 37)) * 2:
+            assert dht.search(key) == alive[np.searchsorted(alive, key) % len(alive)]
+        assert len(dht.ring.cache) == len(dht.ring.cache.ids) == size
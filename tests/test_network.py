@@ -0,0 +1,27 @@
+import numpy as np
+from nsp2p import Network
+
+def reordered_network(routes = None):
+    '''Network whose last evolve only re-sorted links, after its adjacency
+    had been cached (and the searches answered by `routes` if given)'''
+    np.random.seed(0)
+    net = Network(30, 3)
+    pairs = np.random.randint(0, 30, (200, 2)).tolist()
+    net.bfs_batch([0], [1])
+    if routes is not None:
+        net.routes = routes
+        for a, b in pairs:
+            net.search(a, b)
+    links = net.elements[5].links
+    net.elements[5].increment_quality(links[-1], 5)
+    net._dirty.add(5)
+    before = {node: list(net.elements[node].links) for node in net.elements}
+    net.evolve(n_share=0)
+    assert all(sorted(before[node]) == sorted(net.elements[node].links) for node in net.elements)
+    assert before[5] != net.elements[5].links
+    return net, pairs
+
+def test_bfs_batch_after_reordering_evolve():
+    net, pairs = reordered_network()
+    plain = [net.search(a, b) for a, b in pairs]
+    assert net.bfs_batch([a for a, _ in pairs], [b for _, b in pairs]) == plain
@@ -0,0 +1,24 @@
+import numpy as np
+from nsp2p import Network
+from routing import RoutingIndex
+from test_network import reordered_network
+
+def test_same_paths_as_search_after_evolve():
+    for engine in ('dict', 'csr'):
+        np.random.seed(1)
+        net = Network(200, 4, engine)
+        pairs = np.random.randint(0, 200, (300, 2)).tolist()
+        for _ in range(3):
+            net.routes = RoutingIndex()
+            indexed = [net.search(a, b, depth) for a, b in pairs for depth in (1, 3)]
+            net.routes = None
+            assert indexed == [net.search(a, b, depth) for a, b in pairs for depth in (1, 3)]
+            net.simulate(400)
+            net.evolve()
+            net.integrity_check()
+
+def test_reordering_evolve_invalidates_the_index():
+    net, pairs = reordered_network(RoutingIndex())
+    indexed = [net.search(a, b) for a, b in pairs]
+    net.routes = None
+    assert indexed == [net.search(a, b) for a, b in pairs]
@@ -0,0 +1,56 @@
+import asyncio
+import numpy as np
+import pytest
+from nsp2p import Network
+from runtime import MODES, Runtime
+
+async def searches(net, pairs, mode, max_depth = 4):
+    async with Runtime(net, mode=mode) as runtime:
+        paths = [await asyncio.wait_for(runtime.search(start, searched, max_depth), 5) for start, searched in pairs]
+        await asyncio.wait_for(runtime.join(), 5)
+        return paths, runtime
+
+@pytest.mark.parametrize('mode', MODES)
+def test_self_search(mode):
+    np.random.seed(0)
+    net = Network(40, 2)
+    paths, runtime = asyncio.run(searches(net, [(node, node) for node in range(10)], mode))
+    assert runtime.errors == []
+    assert runtime.report()['finished'] == 10
+    for node, path in zip(range(10), paths):
+        if path is not None:
+            assert path[0] == path[-1] == node
+            assert all(b in net.elements[a].links for a, b in zip(path, path[1:]))
+
+def test_failing_message_fails_its_query_only():
+    np.random.seed(0)
+    net = Network(40, 2)
+
+    async def main():
+        async with Runtime(net, mode='flood') as runtime:
+            forward = runtime._forward
+            def broken(node, query, path, ttl):
+                if query.id == 0:
+                    raise RuntimeError('broken')
+                forward(node, query, path, ttl)
+            runtime._forward = broken
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(runtime.search(0, 1), 5)
+            path = await asyncio.wait_for(runtime.search(0, 1), 5)
+            await asyncio.wait_for(runtime.join(), 5)
+            return path, runtime
+
+    path, runtime = asyncio.run(main())
+    assert path is not None
+    assert runtime.errors and runtime.report()['errors'] == len(runtime.errors)
+
+@pytest.mark.parametrize('engine', ('dict', 'csr'))
+def test_visited_mode_finds_the_paths_of_search(engine):
+    np.random.seed(0)
+    net = Network(300, 3, engine)
+    pairs = np.random.randint(0, 300, (300, 2)).tolist() + [(node, node) for node in range(50)]
+    paths, _ = asyncio.run(searches(net, pairs, 'visited', 3))
+    expected = [net.search(start, searched, 3) for start, searched in pairs]
+    # search also accepts the first peer of level max_depth+1
+    assert paths == [path if path is None or len(path) <= 4 else None for path in expected]
+    assert any(path is not None for path in paths[-50:])